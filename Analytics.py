@@ -0,0 +1,114 @@
+import json
+import math
+import numpy as np
+
+
+SPEED_BINS = np.linspace(0, 1000, 41)   # pixels per second, last bin takes faster ones too
+ADDITIVE = "frames", "missing_frames", "path_length", "center_seconds", "periphery_seconds"
+
+
+class AnimalAnalytics(object):
+    """running statistics of one animal in circle arena, fixed work per frame, nothing is kept per frame
+    center_share - center zone radius relative to arena radius
+    grid - heatmap cells along side of square around arena"""
+
+    def __init__(self, border, grid=32, center_share=.5, speed_bins=SPEED_BINS):
+        self.x, self.y, self.radius = border
+        self.grid = grid
+        self.center_radius = center_share * self.radius
+        self.speed_bins = speed_bins
+        self.speed_histogram = np.zeros(len(speed_bins), dtype=np.int64)    # bins[i] <= speed < bins[i + 1]
+        self.heatmap = np.zeros((grid, grid), dtype=np.int64)   # frames in cell, row is y
+        self.frames = 0
+        self.missing_frames = 0
+        self.path_length = 0.
+        self.max_speed = 0.
+        self.center_seconds = 0.
+        self.periphery_seconds = 0.
+        self.last_point = None
+        self.last_point_time = None
+        self.last_time = None
+
+    def add(self, time, point, count=True):
+        """next frame position, None if animal is lost. count False only remembers position, e.g. of warmup frame,
+        so path of segment continues from it"""
+        seconds = 0. if self.last_time is None else time - self.last_time
+        self.last_time = time
+        if not count:
+            if point is not None:
+                self.last_point, self.last_point_time = point, time
+            return
+        self.frames += 1
+        if point is None:   # last point is kept, next step spans the gap
+            self.missing_frames += 1
+            return
+        if self.last_point is not None and time > self.last_point_time:
+            step = math.hypot(point[0] - self.last_point[0], point[1] - self.last_point[1])
+            self.path_length += step
+            speed = step / (time - self.last_point_time)
+            self.max_speed = max(self.max_speed, speed)
+            self.speed_histogram[max(np.searchsorted(self.speed_bins, speed, side="right") - 1, 0)] += 1
+        if math.hypot(point[0] - self.x, point[1] - self.y) <= self.center_radius:
+            self.center_seconds += seconds
+        else:
+            self.periphery_seconds += seconds
+        size = 2. * max(self.radius, 1)
+        column = min(max(int((point[0] - self.x + self.radius) / size * self.grid), 0), self.grid - 1)
+        row = min(max(int((point[1] - self.y + self.radius) / size * self.grid), 0), self.grid - 1)
+        self.heatmap[row, column] += 1
+        self.last_point, self.last_point_time = point, time
+
+    def summary(self):
+        """json ready dictionary"""
+        summary = {name: getattr(self, name) for name in ADDITIVE}
+        summary.update(max_speed=self.max_speed, border=[self.x, self.y, self.radius],
+                       center_radius=self.center_radius, speed_bins=self.speed_bins.tolist(),
+                       speed_histogram=self.speed_histogram.tolist(), heatmap=self.heatmap.tolist())
+        return finishSummary(summary)
+
+
+def finishSummary(summary):
+    """add values derived from accumulators"""
+    seconds = summary["center_seconds"] + summary["periphery_seconds"]
+    summary["tracked_seconds"] = seconds
+    summary["mean_speed"] = summary["path_length"] / seconds if seconds else 0.
+    summary["center_time_share"] = summary["center_seconds"] / seconds if seconds else 0.
+    return summary
+
+
+def summaryText(summaries):
+    """one line per animal"""
+    return "\n".join("arena %i animal %i: path %.0f px, mean speed %.1f px/s, max %.1f px/s, center %.0f%%, "
+                     "lost %i of %i frames" % (summary["arena"], summary["animal"], summary["path_length"],
+                                               summary["mean_speed"], summary["max_speed"],
+                                               summary["center_time_share"] * 100, summary["missing_frames"],
+                                               summary["frames"]) for summary in summaries)
+
+
+def writeSummaries(file_name, summaries):
+    with open(file_name, "w") as summary_file:
+        json.dump(summaries, summary_file, indent=1)
+
+
+def readSummaries(file_name):
+    with open(file_name) as summary_file:
+        return json.load(summary_file)
+
+
+def joinSummaries(file_names, output_name):
+    """add up summaries of consecutive segments of same video"""
+    joined = None
+    for file_name in file_names:
+        summaries = readSummaries(file_name)
+        if joined is None:
+            joined = summaries
+            continue
+        for total, summary in zip(joined, summaries):
+            for name in ADDITIVE:
+                total[name] += summary[name]
+            total["max_speed"] = max(total["max_speed"], summary["max_speed"])
+            for name in "speed_histogram", "heatmap":
+                total[name] = (np.array(total[name]) + summary[name]).tolist()
+    for summary in joined or []:
+        finishSummary(summary)
+    writeSummaries(output_name, joined or [])
@@ -0,0 +1,53 @@
+import os
+import cv2
+import numpy as np
+import Cache
+
+
+def sampleFrames(video_name, size, start_frame, end_frame, samples, index=None):
+    """read frames spread evenly over range with seeks instead of decoding all of them. gray, resized
+    index - VideoIndex for key frame seeks"""
+    capture = cv2.VideoCapture(video_name)
+    if end_frame is None:
+        end_frame = index.frame_count if index else int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or start_frame + 1
+    frames = []
+    for number in np.unique(np.linspace(start_frame, max(start_frame, end_frame - 1), samples).astype(int)):
+        if index:
+            index.seek(capture, int(number))
+        else:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(number))
+        is_frame, frame = capture.read()
+        if is_frame:
+            frames.append(cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2GRAY))
+    capture.release()
+    return frames
+
+
+def buildBackground(video_name, size, start_frame=0, end_frame=None, samples=25, method="median", blur=11,
+                    cache=True, index=None):
+    """gray blurred background of frames sampled across range. mouse moving around disappears in median.
+    result is cached near video and reused while video and parameters are the same"""
+    cache_name = None
+    if cache:
+        cache_name = Cache.cacheName(video_name, "background.npy", tuple(size), start_frame, end_frame, samples,
+                                     method, blur)
+        if os.path.isfile(cache_name):
+            return np.load(cache_name)
+
+    frames = sampleFrames(video_name, tuple(size), start_frame, end_frame, samples, index)
+    if not frames:
+        raise IOError("can't read frames of %s" % video_name)
+    if method == "median":
+        background = np.median(frames, axis=0)
+    elif method == "mean":
+        background = np.mean(frames, axis=0)
+    else:
+        raise ValueError("unknown background method %s" % method)
+    background = cv2.GaussianBlur(background.round().astype(np.uint8), (blur, blur), 0)
+
+    if cache_name:
+        temporary_name = Cache.temporaryName(cache_name)
+        with open(temporary_name, "wb") as cache_file:
+            np.save(cache_file, background)
+        os.replace(temporary_name, cache_name)
+    return background
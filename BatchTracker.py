@@ -0,0 +1,386 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import time
+import argparse
+from concurrent import futures
+import cv2
+import numpy as np
+import MouseTracker
+import Profiler
+import Trajectory
+import Analytics
+import VideoIndex
+import VideoOutput
+
+
+VIDEO_EXTENSIONS = ".mp4", ".avi", ".mov", ".mkv", ".mpg", ".mpeg", ".wmv"
+
+
+def findVideos(path):
+    """expand directory or glob pattern into sorted list of video files"""
+    if os.path.isdir(path):
+        names = [os.path.join(path, name) for name in os.listdir(path)]
+    else:
+        names = glob.glob(path)
+    return sorted(name for name in names if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS)
+
+
+def outputName(input_name, output_dir=None):
+    """same naming as gui save field uses"""
+    output_name = os.path.splitext(input_name)[0] + "_output.avi"
+    if output_dir:
+        output_name = os.path.join(output_dir, os.path.basename(output_name))
+    return output_name
+
+
+def createJobs(paths, defaults):
+    """build job dictionaries from videos, directories, globs and json manifests.
+    manifest is a list of objects with input and optional output, trajectory, video, start, end, center, radius,
+    arenas, animals, analytics and stitch_video keys. arenas is a list of [x, y, radius] or [x, y, radius, animals]"""
+    jobs = []
+    for path in paths:
+        if os.path.splitext(path)[1].lower() == ".json":
+            with open(path) as manifest:
+                entries = json.load(manifest)
+            root = os.path.dirname(path)
+            for entry in entries:
+                job = dict(defaults, **entry)
+                job["input"] = os.path.join(root, job["input"])
+                jobs.append(job)
+        else:
+            jobs.extend(dict(defaults, input=name) for name in findVideos(path))
+    for job in jobs:
+        if not job.get("output"):
+            job["output"] = VideoOutput.outputName(outputName(job["input"], job.get("output_dir")),
+                                                   job.get("codec", "pim1"))
+        if not job.get("video", True) and not job.get("trajectory"):  # analysis only needs some output
+            job["trajectory"] = "csv"
+        if job.get("trajectory") in ("csv", "npy"):   # format only, name it after output
+            job["trajectory"] = os.path.splitext(job["output"])[0] + "." + job["trajectory"]
+        if job.get("analytics") is True:
+            job["analytics"] = os.path.splitext(job["output"])[0] + ".analytics.json"
+    return jobs
+
+
+def jobArenas(job):
+    """list of (center, radius, animals) tracked by job"""
+    if not job.get("arenas"):
+        return [(job["center"], job["radius"], job.get("animals", 1))]
+    return [((arena[0], arena[1]), arena[2], arena[3] if len(arena) > 3 else job.get("animals", 1))
+            for arena in job["arenas"]]
+
+
+def trajectoryNames(job):
+    """trajectory files written by job, one for every animal of every arena"""
+    arenas = jobArenas(job)
+    return [Trajectory.animalName(job["trajectory"], number if len(arenas) > 1 else None,
+                                  animal if animals > 1 else None)
+            for number, (center, radius, animals) in enumerate(arenas) for animal in range(animals)]
+
+
+def createReader(job, output=True):
+    """video reader for job. output False - no video and trajectory files"""
+    return MouseTracker.VideoReader(job["input"], job["output"] if job["video"] and output else None,
+                                    size=tuple(job["size"]),
+                                    start=job["start"],
+                                    end=job["end"],
+                                    trajectory_name=job["trajectory"] if output else None,
+                                    background_samples=job["background_samples"],
+                                    index=VideoIndex.loadIndex(job["input"]) if job["index"] else None,
+                                    warmup=job.get("warmup", 0.),
+                                    background_range=job.get("background_range"),
+                                    profiler=Profiler.Profiler() if job.get("profile") and output else None,
+                                    codec=job.get("codec", "pim1"),
+                                    output_size=job.get("output_size"),
+                                    max_stride=job.get("max_stride", 1),
+                                    max_error=job.get("max_error", 2.),
+                                    analytics_name=job.get("analytics") if output else None)
+
+
+def runJob(job):
+    """worker process. track single video and return statistics"""
+    statistics = {"input": job["input"], "output": job["output"] if job["video"] else job["trajectory"],
+                  "frames": 0, "seconds": 0., "max_stock": 0, "stall_seconds": 0., "error": None, "profile": "",
+                  "analytics": ""}
+    start_time = time.time()
+    try:
+        if not os.path.isfile(job["input"]):
+            raise IOError("no such file")
+        video_reader = createReader(job)
+        if not video_reader.video_reader.isOpened():
+            raise IOError("can't open video")
+        statistics["frames"] = MouseTracker.startTracking(video_reader,
+                                                          threads=job["threads"],
+                                                          processes=job["detectors"],
+                                                          detection_scale=job["detection_scale"],
+                                                          arenas=jobArenas(job),
+                                                          engine=job.get("engine", "contours"))
+        statistics["max_stock"] = video_reader.max_stock
+        statistics["stall_seconds"] = video_reader.stall_seconds
+        statistics["profile"] = video_reader.profiler.summary()
+        statistics["analytics"] = Analytics.summaryText(video_reader.summaries)
+    except Exception as error:  # keep batch running, report failed job
+        statistics["error"] = "%s: %s" % (type(error).__name__, error)
+    statistics["seconds"] = time.time() - start_time
+    return statistics
+
+
+def partName(file_name, part):
+    base, extension = os.path.splitext(file_name)
+    return "%s.part%03i%s" % (base, part, extension)
+
+
+def splitJob(job, segments):
+    """split job range into segment jobs decoded independently. each segment starts tracking earlier by trail
+    length, so trail is continuous across boundaries while mouse is detected. background is sampled over whole
+    range once and shared by segments through cache"""
+    video_reader = createReader(job, output=False)
+    try:
+        if not video_reader.video_reader.isOpened():
+            raise IOError("can't open video")
+        video_reader.getBackground()    # build cache before segments need it
+        last_frame = video_reader.last_frame
+        if last_frame is None:
+            last_frame = (video_reader.index.frame_count if video_reader.index else
+                          int(video_reader.video_reader.get(cv2.CAP_PROP_FRAME_COUNT))) - 1
+        bounds = np.linspace(video_reader.start_frame, last_frame + 1, segments + 1).round().astype(int)
+        parts = []
+        for start_frame, end_frame in zip(bounds[:-1], bounds[1:]):
+            if start_frame >= end_frame:
+                continue
+            part = dict(job,
+                        start=video_reader.frameSecond(start_frame),
+                        end=video_reader.frameSecond(end_frame - 1),
+                        warmup=MouseTracker.TRAIL_LENGTH / video_reader.fps if parts else 0.,
+                        background_range=(job["start"], job["end"]),
+                        output=partName(job["output"], len(parts)),
+                        trajectory=partName(job["trajectory"], len(parts)) if job["trajectory"] else None,
+                        analytics=partName(job["analytics"], len(parts)) if job.get("analytics") else None)
+            parts.append(part)
+        return parts
+    finally:
+        video_reader.video_reader.release()
+
+
+def stitchJob(job, parts):
+    """worker process. join segment trajectories, analytics and image sequences in order and remove them.
+    segment videos are kept as numbered parts, decoding and encoding them again into one file runs in single
+    process and takes about as long as encoding whole video, so it's done only if job asks for stitch_video"""
+    codec = job.get("codec", "pim1")
+    stitch_video = job["video"] and (job.get("stitch_video") or VideoOutput.CODECS[codec][0] is None)
+    output = job["output"] if job["video"] else job["trajectory"]
+    if job["video"] and not stitch_video:
+        output = ", ".join(part["output"] for part in parts)
+    statistics = {"input": job["input"], "output": output,
+                  "frames": sum(part["frames"] for part in parts), "seconds": 0.,
+                  "max_stock": max(part["max_stock"] for part in parts),
+                  "stall_seconds": sum(part["stall_seconds"] for part in parts), "error": None,
+                  "profile": "\n".join("segment %i\n%s" % (number, part["profile"])
+                                       for number, part in enumerate(parts) if part["profile"]),
+                  "analytics": ""}
+    try:
+        errors = [part["error"] for part in parts if part["error"]]
+        if errors:
+            raise RuntimeError("segment failed. %s" % errors[0])
+        if stitch_video and VideoOutput.CODECS[codec][0] is None:   # image sequences are renumbered, not encoded
+            os.makedirs(job["output"], exist_ok=True)
+            number = 0
+            for part in parts:
+                for image_name in sorted(os.listdir(part["output"])):
+                    move = shutil.copyfile if job.get("keep_parts") else os.replace
+                    move(os.path.join(part["output"], image_name),
+                         os.path.join(job["output"], VideoOutput.IMAGE_NAME % number + "." + codec))
+                    number += 1
+        elif stitch_video:
+            video_writer = None
+            for part in parts:
+                capture = VideoOutput.openCapture(part["output"], codec)
+                if video_writer is None:
+                    video_writer = VideoOutput.VideoOutput(job["output"], capture.get(cv2.CAP_PROP_FPS),
+                                                           job.get("output_size") or job["size"], codec)
+                while True:
+                    is_frame, frame = capture.read()
+                    if not is_frame:
+                        break
+                    video_writer.write(frame)
+                capture.release()
+            video_writer.release()
+        if job["trajectory"]:
+            for number, file_name in enumerate(trajectoryNames(job)):
+                Trajectory.joinTrajectories([trajectoryNames(part)[number] for part in parts], file_name)
+        if job.get("analytics"):    # warmup frames carry path across segment bounds, accumulators just add up
+            Analytics.joinSummaries([part["analytics"] for part in parts], job["analytics"])
+            statistics["analytics"] = Analytics.summaryText(Analytics.readSummaries(job["analytics"]))
+        if not job.get("keep_parts"):
+            for part in parts:
+                for file_name in [part["output"] if stitch_video else None, part["analytics"]] + \
+                        (trajectoryNames(part) if part["trajectory"] else []):
+                    if file_name and os.path.isfile(file_name):
+                        os.remove(file_name)
+                    elif file_name and os.path.isdir(file_name):
+                        shutil.rmtree(file_name)
+    except Exception as error:
+        statistics["error"] = "%s: %s" % (type(error).__name__, error)
+    return statistics
+
+
+def runBatch(jobs, processes=None, segments=1, log=sys.stdout):
+    """run jobs in process pool and report throughput. return list of job statistics
+    segments - split every job range into segments rendered in parallel and stitched afterwards"""
+    results = []
+    start_time = time.time()
+
+    def report(statistics):
+        results.append(statistics)
+        if statistics["error"]:
+            log.write("[%i/%i] %s failed. %s\n" % (len(results), len(jobs), statistics["input"],
+                                                    statistics["error"]))
+        else:
+            log.write("[%i/%i] %s %i frames %.1fs %.1f fps, reorder stock %i, stalled %.1fs\n" % (
+                len(results), len(jobs), statistics["input"], statistics["frames"], statistics["seconds"],
+                statistics["frames"] / max(statistics["seconds"], 1e-6), statistics["max_stock"],
+                statistics["stall_seconds"]))
+        if statistics.get("analytics"):
+            log.write(statistics["analytics"] + "\n")
+        if statistics.get("profile"):
+            log.write(statistics["profile"] + "\n")
+        log.flush()
+
+    with futures.ProcessPoolExecutor(processes or os.cpu_count()) as pool:  # not daemonic, jobs may use processes
+        running = {}    # future -> job, segment jobs, finished segment statistics, segment number
+        for job in jobs:
+            if segments < 2:
+                running[pool.submit(runJob, job)] = job, None, None, None
+                continue
+            job["submitted"] = time.time()
+            try:
+                parts = splitJob(job, segments)
+            except Exception as error:
+                report({"input": job["input"], "frames": 0, "seconds": 0., "max_stock": 0, "stall_seconds": 0.,
+                        "error": "%s: %s" % (type(error).__name__, error)})
+                continue
+            finished = {}
+            for number, part in enumerate(parts):
+                running[pool.submit(runJob, part)] = job, parts, finished, number
+
+        while running:
+            for result in futures.wait(running, return_when=futures.FIRST_COMPLETED)[0]:
+                job, parts, finished, number = running.pop(result)
+                statistics = result.result()
+                if parts is None:   # whole job or stitching finished
+                    if "submitted" in job:
+                        statistics["seconds"] = time.time() - job["submitted"]
+                    report(statistics)
+                    continue
+                finished[number] = dict(parts[number], **{key: statistics[key] for key in (
+                    "frames", "max_stock", "stall_seconds", "error", "profile")})
+                if len(finished) == len(parts):
+                    running[pool.submit(stitchJob, job, [finished[i] for i in range(len(parts))])] = \
+                        job, None, None, None
+
+    elapsed = time.time() - start_time
+    frames = sum(statistics["frames"] for statistics in results)
+    log.write("total: %i jobs %i frames %.1fs %.1f fps\n" % (len(results), frames, elapsed,
+                                                            frames / max(elapsed, 1e-6)))
+    return results
+
+
+def createParser():
+    parser = argparse.ArgumentParser(prog="MouseTracker", description="headless mouse tracking")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    batch = commands.add_parser("batch", help="track many videos in parallel processes")
+    batch.add_argument("paths", nargs="+", help="video files, directories, glob patterns or json manifests")
+    batch.add_argument("--center", nargs=2, type=float, default=(.5, .5), metavar=("X", "Y"),
+                       help="arena center relative to frame size")
+    batch.add_argument("--radius", type=float, default=.2, help="arena radius relative to frame width")
+    batch.add_argument("--arena", dest="arenas", nargs=3, type=float, action="append", default=None,
+                       metavar=("X", "Y", "RADIUS"),
+                       help="track several arenas in one pass instead of center and radius. may be repeated")
+    batch.add_argument("--animals", type=int, default=1,
+                       help="animals per arena, written into separate trajectory files")
+    batch.add_argument("--start", type=float, default=0, help="start second")
+    batch.add_argument("--end", type=float, default=None, help="end second. whole video by default")
+    batch.add_argument("--size", nargs=2, type=int, default=(1280, 720), metavar=("WIDTH", "HEIGHT"))
+    batch.add_argument("--output-dir", default=None, help="directory for output videos. near input by default")
+    batch.add_argument("--processes", type=int, default=None, help="parallel jobs. cpu count by default")
+    batch.add_argument("--threads", type=int, default=8, help="tracking threads per job")
+    batch.add_argument("--trajectory", choices=("csv", "npy"), default=None,
+                       help="write per frame positions near output video")
+    batch.add_argument("--no-video", dest="video", action="store_false",
+                       help="analysis only. no output video, trajectory is written as csv if not set")
+    batch.add_argument("--background-samples", type=int, default=25,
+                       help="frames sampled over range for median background")
+    batch.add_argument("--index", action="store_true",
+                       help="build or load cached frame index for exact fps and key frame seeks")
+    batch.add_argument("--segments", type=int, default=1,
+                       help="split every video range into segments rendered by separate processes. trajectories "
+                            "and analytics are joined, videos are kept as numbered parts")
+    batch.add_argument("--stitch-video", action="store_true",
+                       help="join segment videos into one file. decodes and encodes whole video again in single "
+                            "process after segments finish, which costs about as much as rendering without segments")
+    batch.add_argument("--keep-parts", action="store_true", help="keep segment files after stitching")
+    batch.add_argument("--detection-scale", type=float, default=1.,
+                       help="detection resolution relative to output size, e.g. 0.25")
+    batch.add_argument("--detectors", type=int, default=0,
+                       help="detector processes per job with shared memory frames. threads are used if 0")
+    batch.add_argument("--engine", choices=sorted(MouseTracker.ENGINES), default="contours",
+                       help="blob detection. components is faster, area is pixel count instead of outline area")
+    batch.add_argument("--codec", choices=sorted(VideoOutput.CODECS), default="pim1",
+                       help="output codec. jpg and png write image sequence into directory named after output")
+    batch.add_argument("--output-size", nargs=2, type=int, default=None, metavar=("WIDTH", "HEIGHT"),
+                       help="output video resolution. tracking size by default")
+    batch.add_argument("--max-stride", type=int, default=1,
+                       help="skip detection of up to stride frames in row while nothing moves and interpolate them. "
+                            "without video frames are not even decoded, good for long static recordings")
+    batch.add_argument("--max-error", type=float, default=2.,
+                       help="pixels interpolated positions may be off, smaller is more sensitive to change")
+    batch.add_argument("--analytics", action="store_true",
+                       help="write path length, speed histogram, center and periphery time and heatmap near output")
+    batch.add_argument("--profile", action="store_true",
+                       help="record stage latencies and lock waits, print breakdown after every job")
+    return parser
+
+
+def main(argv):
+    """command line entry point. return exit code"""
+    arguments = createParser().parse_args(argv)
+    defaults = {"center": arguments.center,
+                "radius": arguments.radius,
+                "arenas": arguments.arenas,
+                "animals": arguments.animals,
+                "start": arguments.start,
+                "end": arguments.end,
+                "size": arguments.size,
+                "output_dir": arguments.output_dir,
+                "threads": arguments.threads,
+                "detectors": arguments.detectors,
+                "detection_scale": arguments.detection_scale,
+                "trajectory": arguments.trajectory,
+                "video": arguments.video,
+                "background_samples": arguments.background_samples,
+                "index": arguments.index,
+                "keep_parts": arguments.keep_parts,
+                "stitch_video": arguments.stitch_video,
+                "profile": arguments.profile,
+                "analytics": arguments.analytics,
+                "codec": arguments.codec,
+                "engine": arguments.engine,
+                "max_stride": arguments.max_stride,
+                "max_error": arguments.max_error,
+                "output_size": arguments.output_size}
+    jobs = createJobs(arguments.paths, defaults)
+    if not jobs:
+        sys.stderr.write("no videos found\n")
+        return 1
+    if arguments.output_dir and not os.path.isdir(arguments.output_dir):
+        os.makedirs(arguments.output_dir)
+    results = runBatch(jobs, arguments.processes, arguments.segments)
+    return 1 if any(statistics["error"] for statistics in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent import futures
+import multiprocessing
+import cv2
+import numpy as np
+import MouseTracker
+import Trajectory
+import BufferPool
+
+
+CONFIGURATIONS = ({"name": "threads1", "threads": 1},
+                  {"name": "threads2", "threads": 2},
+                  {"name": "threads4", "threads": 4},
+                  {"name": "threads8", "threads": 8},
+                  {"name": "detectors2", "detectors": 2},
+                  {"name": "scale0.5", "threads": 8, "detection_scale": .5},
+                  {"name": "no_video", "threads": 8, "video": False},
+                  {"name": "components", "threads": 8, "engine": "components"},
+                  {"name": "xvid", "threads": 8, "codec": "xvid"},
+                  {"name": "mjpg", "threads": 8, "codec": "mjpg"})
+ARENA = (.5, .5), .25   # center and radius relative to frame, same as tracking gets
+
+
+def pointLoopCheck(contour, border):
+    """per point border check tracker used before ring lookup. reference for comparison"""
+    for line in contour:
+        x = line[0][0] - border[0]
+        y = line[0][1] - border[1]
+        length = math.sqrt(x ** 2 + y ** 2)
+        if length / border[2] >= .99:
+            return False
+    return True
+
+
+def noisyContours(arena, count, seed=0):
+    """contours of noisy blobs inside arena like thresholded difference gives, one list per frame"""
+    random = np.random.RandomState(seed)
+    height, width = arena.mask.shape
+    frames = []
+    for i in range(count):
+        coarse = random.randint(0, 0x100, (height // 40, width // 40)).astype(np.uint8)   # blobs
+        coarse = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+        fine = cv2.GaussianBlur(random.randint(0, 0x100, (height, width)).astype(np.uint8), (5, 5), 0)  # ragged edges
+        frame = cv2.addWeighted(coarse, .8, fine, .2, 0)
+        frame = cv2.threshold(frame, 170, 0xff, cv2.THRESH_BINARY)[1]
+        frame = cv2.dilate(frame, None, iterations=2)
+        frame &= arena.mask
+        contours = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        frames.append(sorted(contours, key=lambda contour: cv2.contourArea(contour), reverse=True))
+    return frames
+
+
+def benchmarkCheckContour(size=(1280, 720), radius=.25, count=500):
+    """per frame cost of border check for point loop and ring lookup. return dictionary"""
+    arena = MouseTracker.Arena((.5, .5), radius, size)
+    MouseTracker.Region([arena], np.zeros((size[1], size[0]), dtype=np.uint8))
+    frames = noisyContours(arena, count)
+    results = {"frames": count, "points": int(sum(contour.shape[0] for contours in frames for contour in contours))}
+    border = [arena.border[0] - arena.left, arena.border[1] - arena.top, arena.border[2]]   # box coordinates
+    for name, check, argument in (("point_loop", pointLoopCheck, border),
+                                  ("ring_lookup", MouseTracker.checkContour, arena)):
+        start_time = time.perf_counter()
+        answers = [[check(contour, argument) for contour in contours] for contours in frames]
+        results[name + "_ms"] = (time.perf_counter() - start_time) * 1e3 / count
+        results[name + "_answers"] = answers
+    results["same_answers"] = results.pop("point_loop_answers") == results.pop("ring_lookup_answers")
+    return results
+
+
+def syntheticVideo(file_name, size=(1280, 720), frames=250, fps=25., seed=0):
+    """write arena video with dark blob moving along known path. return ground truth centers, shape (frames, 2)
+    blob is drawn with subpixel precision, light noise keeps threshold and contours realistic"""
+    random = np.random.RandomState(seed)
+    width, height = size
+    (x, y), radius = ARENA
+    x, y, radius = x * width, y * height, radius * width
+    background = np.full((height, width, 3), 90, dtype=np.uint8)
+    cv2.circle(background, (int(x), int(y)), int(radius), (200, 200, 200), thickness=-1)
+    phase = np.arange(frames) * 2 * math.pi / max(frames, 1)
+    truth = np.stack([x + radius * .6 * np.sin(phase * 2), y + radius * .6 * np.sin(phase * 3 + 1)], axis=1)
+    axes = (max(2, int(width / 64)), max(1, int(width / 110)))
+    writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    noise = np.empty((height, width, 3), dtype=np.int16)
+    for number, (blob_x, blob_y) in enumerate(truth):
+        frame = background.copy()
+        cv2.ellipse(frame, (int(round(blob_x * 16)), int(round(blob_y * 16))), (axes[0] * 16, axes[1] * 16),
+                    math.degrees(phase[number] * 4), 0, 360, (30, 30, 30), thickness=-1, lineType=cv2.LINE_AA,
+                    shift=4)
+        noise[:] = random.randint(-6, 7, noise.shape)
+        writer.write(np.clip(frame + noise, 0, 0xff).astype(np.uint8))
+    writer.release()
+    return truth
+
+
+def stageTimes(video_name, size, frames):
+    """milliseconds per frame of every pipeline stage run alone in single thread"""
+    capture = cv2.VideoCapture(video_name)
+    decoded = []
+    start_time = time.perf_counter()
+    while len(decoded) < frames:
+        is_frame, frame = capture.read()
+        if not is_frame:
+            break
+        decoded.append(cv2.resize(frame, size))
+    times = {"decode": time.perf_counter() - start_time}
+    capture.release()
+    background = cv2.GaussianBlur(np.median([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in decoded[::10]],
+                                            axis=0).astype(np.uint8), (11, 11), 0)
+    arena = MouseTracker.Arena(ARENA[0], ARENA[1], size)
+    region = MouseTracker.Region([arena], background)
+    buffers = BufferPool.Buffers()  # like tracking thread
+    start_time = time.perf_counter()
+    found = [MouseTracker.detectMice(frame, region, buffers=buffers) for frame in decoded]
+    times["detect"] = time.perf_counter() - start_time
+    components = MouseTracker.Region([MouseTracker.Arena(ARENA[0], ARENA[1], size)], background, engine="components")
+    start_time = time.perf_counter()
+    for frame in decoded:
+        MouseTracker.detectMice(frame, components, buffers=buffers)
+    times["detect_components"] = time.perf_counter() - start_time
+    directory = tempfile.mkdtemp()
+    try:
+        video_reader = MouseTracker.VideoReader(video_name, os.path.join(directory, "stage.avi"), size=size,
+                                                prefetch=len(decoded) + 1)
+        video_reader.setArenas([arena])
+        for frame, contours in zip(decoded, found):
+            video_reader.tracked_frames.put((frame, contours))
+        video_reader.tracked_frames.put(None)
+        start_time = time.perf_counter()
+        video_reader.write()    # writer stage in this thread
+        video_reader.close()    # waits for encoder thread
+        times["write"] = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(directory)
+    return {name + "_ms": seconds * 1e3 / max(len(decoded), 1) for name, seconds in times.items()}
+
+
+def peakMemory(children=False):
+    """peak resident memory of process or its waited children in MB. None where resource module is missing"""
+    try:
+        import resource     # posix only
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def trackingRun(video_name, size, configuration):
+    """process for single configuration, so peak memory belongs to it. return statistics dictionary"""
+    directory = tempfile.mkdtemp()
+    try:
+        output_name = os.path.join(directory, "output.avi") if configuration.get("video", True) else None
+        trajectory_name = os.path.join(directory, "trajectory.npy")
+        video_reader = MouseTracker.VideoReader(video_name, output_name, size=size, start=0, end=None,
+                                                trajectory_name=trajectory_name,
+                                                codec=configuration.get("codec", "pim1"))
+        start_time = time.perf_counter()
+        frames = MouseTracker.startTracking(video_reader, ARENA[0], ARENA[1], threads=configuration.get("threads", 8),
+                                            processes=configuration.get("detectors", 0),
+                                            detection_scale=configuration.get("detection_scale", 1.),
+                                            engine=configuration.get("engine", "contours"))
+        seconds = time.perf_counter() - start_time
+        trajectory = np.array(Trajectory.readTrajectory(trajectory_name))
+    finally:
+        shutil.rmtree(directory)
+    return {"frames": frames, "seconds": seconds, "fps": frames / max(seconds, 1e-6),
+            "max_stock": video_reader.max_stock, "stall_seconds": video_reader.stall_seconds,
+            "allocations": video_reader.frame_pool.allocations(),
+            "peak_memory_mb": peakMemory(),
+            "detector_memory_mb": peakMemory(children=True),
+            "trajectory": trajectory[["frame", "x", "y", "detected"]].tolist()}
+
+
+def centroidError(trajectory, truth):
+    """mean and max distance of detected centers from ground truth in pixels and share of detected frames"""
+    rows = np.array(trajectory, dtype=[("frame", np.int64), ("x", np.float64), ("y", np.float64),
+                                       ("detected", np.bool_)])
+    rows = rows[rows["detected"] & (rows["frame"] < len(truth))]
+    if not rows.size:
+        return {"detected": 0., "mean_error": None, "max_error": None}
+    errors = np.hypot(rows["x"] - truth[rows["frame"], 0], rows["y"] - truth[rows["frame"], 1])
+    return {"detected": rows.size / float(len(truth)), "mean_error": float(errors.mean()),
+            "max_error": float(errors.max())}
+
+
+def benchmarkTracking(resolutions=((640, 360), (1280, 720), (1920, 1080)), lengths=(250, ),
+                      configurations=CONFIGURATIONS, log=sys.stdout):
+    """track synthetic videos with every configuration. return list of result dictionaries"""
+    results = []
+    directory = tempfile.mkdtemp()
+    if "forkserver" in multiprocessing.get_all_start_methods():  # peak memory is inherited through fork and exec,
+        from multiprocessing import forkserver  # so runs are forked from server started while parent is small
+        context = multiprocessing.get_context("forkserver")
+        forkserver.ensure_running()
+    else:   # windows spawns fresh interpreter anyway
+        context = multiprocessing.get_context()
+    try:
+        for size in resolutions:
+            for length in lengths:
+                video_name = os.path.join(directory, "synthetic_%ix%i_%i.mp4" % (size[0], size[1], length))
+                truth = syntheticVideo(video_name, size, length)
+                MouseTracker.VideoReader(video_name, None, size=size, start=0, end=None).getBackground()  # cache
+                stages = stageTimes(video_name, size, length)
+                log.write("%ix%i %i frames: decode %.2f, detect %.2f (components %.2f), write %.2f ms/frame\n" % (
+                    size[0], size[1], length, stages["decode_ms"], stages["detect_ms"],
+                    stages["detect_components_ms"], stages["write_ms"]))
+                for configuration in configurations:
+                    with futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                        statistics = pool.submit(trackingRun, video_name, size, configuration).result()
+                    statistics.update(centroidError(statistics.pop("trajectory"), truth))
+                    statistics.update(stages)
+                    statistics.update(width=size[0], height=size[1], length=length, **configuration)
+                    results.append(statistics)
+                    log.write("  %-10s %6.1f fps, peak %5s MB, %4i buffers, error %s px, detected %.0f%%\n" % (
+                        configuration["name"], statistics["fps"], "-" if statistics["peak_memory_mb"] is None else
+                        "%.0f" % statistics["peak_memory_mb"],
+                        statistics["allocations"],
+                        "-" if statistics["mean_error"] is None else "%.2f" % statistics["mean_error"],
+                        statistics["detected"] * 100))
+                    log.flush()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="Benchmark", description="tracking pipeline benchmarks")
+    parser.add_argument("--frames", type=int, default=500, help="frames of border check benchmark")
+    parser.add_argument("--tracking", action="store_true",
+                        help="track synthetic videos with every configuration and compare with ground truth")
+    parser.add_argument("--sizes", nargs="+", default=["640x360", "1280x720", "1920x1080"],
+                        help="synthetic video resolutions, WIDTHxHEIGHT")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[250], help="synthetic video lengths in frames")
+    parser.add_argument("--configurations", nargs="+", default=None,
+                        help="names of configurations to run, all by default: %s" % ", ".join(
+                            configuration["name"] for configuration in CONFIGURATIONS))
+    parser.add_argument("--json", default=None, help="write results to json file for comparison between versions")
+    arguments = parser.parse_args(argv)
+    results = benchmarkCheckContour(count=arguments.frames)
+    print("checkContour: %i frames, %i contour points" % (results["frames"], results["points"]))
+    print("  point loop  %.3f ms/frame" % results["point_loop_ms"])
+    print("  ring lookup %.3f ms/frame" % results["ring_lookup_ms"])
+    print("  same answers: %s" % results["same_answers"])
+    report = {"check_contour": results}
+    if arguments.tracking:
+        configurations = [configuration for configuration in CONFIGURATIONS
+                          if not arguments.configurations or configuration["name"] in arguments.configurations]
+        report["tracking"] = benchmarkTracking([tuple(int(value) for value in size.split("x"))
+                                                for size in arguments.sizes], arguments.lengths, configurations)
+    if arguments.json:
+        with open(arguments.json, "w") as json_file:
+            json.dump(report, json_file, indent=1)
+    return 0 if results["same_answers"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+import threading
+import collections
+import numpy as np
+
+
+class Buffers(object):
+    """named reusable arrays of one thread, passed as dst of opencv calls. array is allocated again only when
+    shape changes, so steady state allocates nothing"""
+
+    def __init__(self):
+        self.arrays = {}
+        self.allocated = 0  # arrays ever made
+
+    def get(self, name, shape, dtype=np.uint8):
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.arrays[name] = np.empty(shape, dtype=dtype)
+            self.allocated += 1
+        return array
+
+
+class FramePool(object):
+    """free frames of one shape reused along pipeline. decoder takes frame, it's put back after it's encoded or
+    written without video. pool grows to frames in flight and stays there"""
+
+    def __init__(self, shape, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.free = collections.deque()     # append and pop are thread safe
+        self.lock = threading.Lock()
+        self.allocated = 0  # frames ever made
+        self.thread_buffers = []    # Buffers given to threads, counted by allocations
+
+    def get(self):
+        """free frame or new one. content is undefined"""
+        try:
+            return self.free.pop()
+        except IndexError:
+            pass
+        with self.lock:
+            self.allocated += 1
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def put(self, frame):
+        """give frame back. frames of other shape and None are ignored"""
+        if frame is not None and frame.shape == self.shape:
+            self.free.append(frame)
+
+    def buffers(self):
+        """Buffers for one thread, its allocations are counted by pool"""
+        buffers = Buffers()
+        with self.lock:
+            self.thread_buffers.append(buffers)
+        return buffers
+
+    def allocations(self):
+        """frames and thread buffers allocated so far. stays constant once pipeline is full"""
+        with self.lock:
+            return self.allocated + sum(buffers.allocated for buffers in self.thread_buffers)
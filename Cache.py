@@ -0,0 +1,30 @@
+import os
+import threading
+import hashlib
+
+
+CACHE_DIRECTORY = ".mousetracker"   # created near video
+USER_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "mousetracker")   # if video folder is read only
+
+
+def cacheName(video_name, kind, *key):
+    """cache file name for video. file is different if video path, size or mtime or key parameters change
+    kind - file suffix, e.g. background.npy"""
+    video_name = os.path.abspath(video_name)
+    stat = os.stat(video_name)
+    digest = hashlib.sha1(repr((video_name, stat.st_size, stat.st_mtime) + key).encode()).hexdigest()[:16]
+    file_name = "%s.%s.%s" % (os.path.basename(video_name), digest, kind)
+    for directory in os.path.join(os.path.dirname(video_name), CACHE_DIRECTORY), USER_CACHE_DIRECTORY:
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(directory, os.W_OK):
+            return os.path.join(directory, file_name)
+    return os.path.join(USER_CACHE_DIRECTORY, file_name)
+
+
+def temporaryName(file_name):
+    """name for writing cache before os.replace, so readers never see half written file. unique per thread,
+    render jobs of one process may build same cache at once"""
+    return "%s.%i.%i.tmp" % (file_name, os.getpid(), threading.get_ident())
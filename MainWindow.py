@@ -1,4 +1,4 @@
-import queue
+import os
 import threading
 import cv2
 from PyQt5.Qt import *
@@ -6,6 +6,9 @@ import ButtonWidget
 import VideoWidget
 import SliderWidget
 import MouseTracker
+import VideoIndex
+import Proxy
+import RenderQueue
 
 
 class MainWindow(QWidget):
@@ -13,7 +16,10 @@ class MainWindow(QWidget):
     def __init__(self):
         QWidget.__init__(self)
         self.setWindowTitle("Big Brother watches you")
-        self.video_reader = None
+        self.capture = None     # selected video for picker
+        self.video_file = None  # path of selected video, index thread compares it instead of reading widgets
+        self.index = None   # VideoIndex of selected video, built in background
+        self.proxy = None   # thumbnails of selected video for scrubbing and picker, built in background
         self.left_grid = QGridLayout(self)
         self.setLayout(self.left_grid)
 
@@ -54,15 +60,17 @@ class MainWindow(QWidget):
         self.left_grid.addWidget(self.frame_slider, 4, 1, 1, 1)
         self.left_grid.addWidget(self.time_current, 4, 2, 1, 1)
 
-        # queue
-        self.queue = queue.Queue()  # sync
-        self.render_log = VideoWidget.ProceedImage(self.queue)
+        # preview
+        self.preview = MouseTracker.PreviewChannel(fps=25)    # latest frame only
+        self.render_log = VideoWidget.ProceedImage(self.preview)
         self.render_log.start()
+        self.render_queue = RenderQueue.RenderQueue(1, self.preview)    # preview goes to oldest running job
 
         # signals
         self.file_button.file_selected.connect(self.file_text.setText)
         self.file_button.file_selected.connect(self.player.openVideo)
         self.file_button.file_selected.connect(self.file_text_out.setFromOutput)
+        self.file_button.file_selected.connect(self.openVideo)
         self.file_button_out.file_selected.connect(self.file_text_out.setText)
         self.range_slider.left_slider_changed.connect(self.frame_slider.setMinValue)
         self.range_slider.left_slider_changed.connect(self.time_left.setValue)
@@ -71,12 +79,13 @@ class MainWindow(QWidget):
         self.range_slider.right_slider_changed.connect(self.time_right.setValue)
         self.time_right.time_changed.connect(self.range_slider.setRightValue)
         self.frame_slider.slider_changed.connect(self.time_current.setValue)
-        self.frame_slider.player_update.connect(self.player.setCurrentSecond)
+        self.frame_slider.player_update.connect(self.showSecond)
         self.frame_slider.player_stop.connect(self.player.media_player.pause)
         self.time_current.time_changed.connect(self.frame_slider.setValue)
         self.player.duration_changed.connect(self.range_slider.setMaxValue)
         self.player.current_frame_changed.connect(self.frame_slider.setValuePlayer)
         self.player.media_player.stateChanged.connect(self.play_button.getPlayerState)
+        self.play_button.play_player.connect(self.syncPlayer)
         self.play_button.play_player.connect(self.player.media_player.play)
         self.play_button.play_player.connect(self.player.setVideoPlayer)
         self.play_button.play_player.connect(self.picker.hide)
@@ -117,40 +126,153 @@ class MainWindow(QWidget):
         self.cmb_res.currentIndexChanged.connect(self.changeResolution)
         self.left_grid.addWidget(self.cmb_res, 4, 4, 1, 3)
 
+        # render jobs, details of selected one below
+        self.lst_jobs = QListWidget()
+        self.lst_jobs.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.lst_jobs.itemSelectionChanged.connect(self.showStatistics)
         self.text_out = QTextEdit()
-        self.left_grid.addWidget(self.text_out, 2, 4, 1, 4)
+        self.text_out.setReadOnly(True)
+        self.text_out.setLineWrapMode(QTextEdit.NoWrap)
+        self.text_out.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.spl_jobs = QSplitter(Qt.Vertical)
+        self.spl_jobs.addWidget(self.lst_jobs)
+        self.spl_jobs.addWidget(self.text_out)
+        self.left_grid.addWidget(self.spl_jobs, 2, 4, 1, 4)
+
+        self.chk_profile = QCheckBox("profile stages")
+        self.left_grid.addWidget(self.chk_profile, 3, 4, 1, 3)
+
+        self.spn_jobs = QSpinBox()
+        self.spn_jobs.setRange(1, 8)
+        self.spn_jobs.setPrefix("jobs: ")
+        self.spn_jobs.setToolTip("renders running at once")
+        self.spn_jobs.valueChanged.connect(self.render_queue.setConcurrency)
+        self.left_grid.addWidget(self.spn_jobs, 3, 7, 1, 1)
+
+        # render statistics
+        self.statistics_timer = QTimer(self)
+        self.statistics_timer.setInterval(500)
+        self.statistics_timer.timeout.connect(self.sampleStatistics)
+        self.job_progress = {}  # running job -> progress line of last timer tick
 
         self.changeResolution()
 
     def startRender(self):
-        """execute rendering"""
-        if self.video_reader:
-            self.video_reader.stop()
-
+        """queue render of selected range and arena, it starts when job slot is free"""
         self.picker.hide()
-        self.video_reader = MouseTracker.VideoReader(self.file_text.text(),
-                                                     self.file_text_out.text(),
-                                                     start=self.range_slider.left_value,
-                                                     end=self.range_slider.right_value,
-                                                     frame_queue=self.queue,
-                                                     size=(1280, 720))
-        args = (self.video_reader, self.picker.center, self.picker.radius)
-        threading.Thread(target=MouseTracker.startTracking, args=args).start()
+        output_name = self.file_text_out.text()
+        job = RenderQueue.RenderJob(self.file_text.text(), output_name, self.range_slider.left_value,
+                                    self.range_slider.right_value, [(self.picker.center, self.picker.radius)],
+                                    trajectory_name=os.path.splitext(output_name)[0] + ".csv",
+                                    analytics_name=os.path.splitext(output_name)[0] + ".analytics.json",
+                                    index=self.index, profile=self.chk_profile.isChecked())
+        self.lst_jobs.addItem(QListWidgetItem(os.path.basename(job.input_name)))
+        self.render_queue.add(job)
+        self.statistics_timer.start()
+        self.showStatistics()
 
     def stopRender(self):
-        """stop render"""
-        if self.video_reader:
-            self.video_reader.stop()
+        """cancel selected jobs or all unfinished ones if none is selected"""
+        rows = sorted(index.row() for index in self.lst_jobs.selectedIndexes())
+        self.render_queue.cancel([self.render_queue.jobs[row] for row in rows] if rows else None)
+        self.showStatistics()
+
+    def sampleStatistics(self):
+        """timer tick. progress of running jobs is sampled once per tick, fps is measured between ticks"""
+        self.job_progress = {job: job.progress() for job in list(self.render_queue.jobs)
+                             if job.state == RenderQueue.RenderJob.RUNNING}
+        self.showStatistics()
+
+    def showStatistics(self):
+        """live progress and throughput of every job, stage breakdown and analytics of selected or last job.
+        running jobs show line of last tick, sampling them here would measure fps over no time"""
+        jobs = list(self.render_queue.jobs)
+        progress = [self.job_progress.get(job, job.state) if job.state == RenderQueue.RenderJob.RUNNING else
+                    job.progress() for job in jobs]
+        for row, job in enumerate(jobs):
+            self.lst_jobs.item(row).setText("%s %i-%is: %s" % (os.path.basename(job.input_name), job.start, job.end,
+                                                               progress[row]))
+        rows = sorted(index.row() for index in self.lst_jobs.selectedIndexes())
+        if not jobs:
+            return
+        row = rows[-1] if rows else len(jobs) - 1
+        job = jobs[row]
+        details = [job.output_name, progress[row], job.summary() or job.profiler.summary()]
+        self.text_out.setPlainText("\n".join(text for text in details if text))
+        if not self.render_queue.busy():
+            self.statistics_timer.stop()
+
+    def closeEvent(self, event):
+        """cancel renders and wait till their files are closed"""
+        if self.proxy:
+            self.proxy.stop()
+        self.render_queue.close()
+        QWidget.closeEvent(self, event)
+
+    def openVideo(self, video_file):
+        """open video for picker and start building its index and proxy"""
+        self.video_file = video_file
+        self.capture = cv2.VideoCapture(video_file)
+        self.index = None
+        if self.proxy:
+            self.proxy.stop()
+        self.proxy = None
+        threading.Thread(target=self.loadIndex, args=(video_file, ), daemon=True).start()
+
+    def loadIndex(self, video_file):
+        """index thread. cached index and proxy are loaded immediately. otherwise thumbnails are taken in the same
+        pass that builds index, proxy is decoded separately only if index was cached"""
+        try:
+            index = VideoIndex.cachedIndex(video_file)
+            proxy = Proxy.openProxy(video_file, index)
+            if video_file != self.video_file:   # other video may be selected meanwhile
+                return
+            self.proxy = proxy  # thumbnails are shown while they are filled
+            if index is None:
+                index = VideoIndex.loadIndex(video_file, visit=proxy and proxy.visit)
+            if video_file != self.video_file:
+                return
+            self.index = index
+            if proxy is None:   # no metadata to size it before index
+                proxy = self.proxy = Proxy.openProxy(video_file, index)
+            if proxy is not None:
+                proxy.build(video_file, index)
+        except (IOError, OSError):
+            return
+
+    def showSecond(self, second):
+        """scrub on proxy thumbnails while player is paused and nothing renders, otherwise seek player"""
+        frame = self.proxy.frameAt(second) if self.proxy else None
+        rendering = self.render_queue.preview_job is not None   # viewport shows render preview
+        if frame is None or rendering or self.player.media_player.state() == QMediaPlayer.PlayingState:
+            self.player.setCurrentSecond(second)
+        else:
+            self.player.setMatrixImage(frame)
+
+    def syncPlayer(self):
+        """player wasn't seeked while scrubbing on proxy"""
+        self.player.setCurrentSecond(self.frame_slider.value)
 
     def circleMode(self):
-        """turn on circle point mode"""
-        video_reader = cv2.VideoCapture(self.file_text.text())
-        is_frame, frame = video_reader.read()
-        if is_frame:
+        """turn on circle point mode on current frame"""
+        frame = self.proxy.frameAt(self.frame_slider.value) if self.proxy else None
+        if frame is not None:   # picker takes relative coordinates, so thumbnail is enough
+            self.player.setMatrixImage(frame)
+            self.picker.show()
+            return
+        if self.capture is None:
+            return
+        if self.index:
+            frame = self.index.readFrame(self.capture, self.index.frameAt(self.frame_slider.value))
+        else:
+            self.capture.set(cv2.CAP_PROP_POS_MSEC, self.frame_slider.value * 1e3)
+            frame = self.capture.read()[1]
+        if frame is not None:
             self.player.setMatrixImage(frame)
             self.picker.show()
 
     def changeResolution(self, resolution=0):
+        self.preview.size = self.player.width(), self.player.height()
         if resolution == 0:
             self.setFixedSize(900, 490)
         else:
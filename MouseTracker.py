@@ -1,146 +1,785 @@
+import sys
+import time
+import queue
 import threading
-import itertools
-import math
 import cv2
 import numpy as np
+import ProcessTracker
+import Profiler
+import Trajectory
+import Analytics
+import Background
+import VideoOutput
+import BufferPool
+
+
+TRAIL_LENGTH = 251   # last 250 path points and the new one
+CHANGE_THRESHOLD = 10    # gray levels of tiny frame cell which mean motion
+TRAIL_COLORS = (0, 0xff, 0xff), (0xff, 0xff, 0), (0xff, 0, 0xff), (0, 0x80, 0xff), (0xff, 0x80, 0), (0x80, 0xff, 0)
+
+
+class Trail(object):
+    """last path points in fixed size ring buffer. every point is stored twice, so last points are one slice"""
+
+    def __init__(self, length=250):
+        self.length = length
+        self.buffer = np.zeros((length * 2, 2), dtype=np.int32)
+        self.index = 0  # next position
+        self.count = 0
+
+    def append(self, point):
+        self.buffer[self.index] = self.buffer[self.index + self.length] = point
+        self.index = (self.index + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+    def points(self):
+        """view of points from oldest to newest"""
+        end = self.index + self.length
+        return self.buffer[end - self.count:end]
+
+    def draw(self, frame, color=(0, 0xff, 0xff)):
+        """draw path with single call"""
+        if self.count > 1:
+            cv2.polylines(frame, [self.points()], False, color)
+
+
+class PreviewChannel(object):
+    """latest frame only channel from writer to viewport. new frame overwrites old one, rate is limited by fps"""
+
+    def __init__(self, fps=25., size=(640, 360)):
+        self.interval = 1. / fps
+        self.size = size    # viewport size, frames are shrunk before gui thread gets them
+        self.condition = threading.Condition()
+        self.item = None
+        self.put_time = -self.interval
+
+    def wanted(self):
+        """true if it's time for new frame. frames which are not wanted should not be drawn or copied"""
+        return time.monotonic() - self.put_time >= self.interval
+
+    def put(self, second, frame):
+        """shrunk copy of frame replaces previous one"""
+        frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_LINEAR)
+        with self.condition:
+            self.item = second, frame
+            self.put_time = time.monotonic()
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """wait for frame. return second and frame or None if timed out"""
+        with self.condition:
+            if self.item is None:
+                self.condition.wait(timeout)
+            item, self.item = self.item, None
+        return item
 
 
 class VideoReader(object):
-    """multi threading video reader writer"""
+    """multi threading video reader writer.
+    decoder thread -> tracking threads -> ordered writer thread -> encoder thread, stages are connected with
+    bounded queues
+    output_name None - analysis only, no video is encoded and frames are drawn only for preview
+    preview - PreviewChannel, frames are drawn and shrunk only when it wants them
+    warmup - seconds before start tracked only to fill trail, e.g. for segment of longer range
+    background_range - seconds to sample background from. start and end by default
+    profiler - Profiler.Profiler for stage timing, disabled by default
+    codec - VideoOutput.CODECS key, output_size - output resolution, tracking size by default
+    max_stride - frames without change are not detected up to max stride frames in row, their positions are
+    interpolated. frames are not even decoded if there is no output video or preview, see decode
+    max_error - pixels interpolated positions may be off for blobs contrasting 40 gray levels or more
+    analytics_name - json file for path length, speed, zone and heatmap summary of every animal"""
 
-    def __init__(self, input_name, output_name, size=(1280, 720), start=0, end=5, frame_queue=None):
+    def __init__(self, input_name, output_name, size=(1280, 720), start=0, end=5, preview=None, prefetch=16,
+                 trajectory_name=None, background_samples=25, background_method="median", window=32, index=None,
+                 warmup=0., background_range=None, profiler=None, codec="pim1", output_size=None, max_stride=1,
+                 max_error=2., analytics_name=None):
+        self.input_name = input_name
         self.video_reader = cv2.VideoCapture(input_name)
-        self.fps = self.video_reader.get(cv2.CAP_PROP_FPS)
+        self.index = index  # VideoIndex for exact fps and key frame seeks
+        self.fps = index.fps if index and index.fps else self.video_reader.get(cv2.CAP_PROP_FPS)
         self.size = size
-        self.current_second_in = self.current_second_out = self.start_second = start
-        self.end_second = end
-        self.current_frame_out = itertools.count()   # to be increased after giving away frame
-        self.current_frame_in = 0    # to be increased after taking frame
+        self.start_second = start
+        self.end_second = float("inf") if end is None else end  # None - till the end of video
+        self.start_frame = self.frameAt(start)
+        self.last_frame = None if end is None else self.frameAt(end)
+        self.first_frame = self.frameAt(max(0, start - warmup)) if warmup else self.start_frame    # decoding starts
+        self.warmup_frames = self.start_frame - self.first_frame
+        self.background_range = background_range or (start, end)
+        self.total_frames = None    # frames to write, known after start
+        self.current_frame_out = 0   # to be increased after decoding frame
+        self.current_frame_in = 0    # to be increased after giving frame to writer
+        self.current_frame_taken = 0     # to be increased after writer takes frame, reorder window starts there
+        self.current_frame_written = 0   # to be increased after writing frame
         self.lock = threading.Lock()
+        self.frame_given = threading.Condition(self.lock)   # writer took frame or job is cancelled, window moved
+        self.window = window    # frames in flight ahead of the next one writer takes
         self.frames_stock = {}
-        self.points_stock = []
-        self.frame_queue = frame_queue
-        self.video_writer = cv2.VideoWriter(output_name, cv2.VideoWriter_fourcc(*'PIM1'), self.fps, self.size)
+        self.max_stock = 0  # deepest reorder stock
+        self.stalls = 0     # times tracking thread waited for window
+        self.stall_seconds = 0.
+        self.arenas = []    # arenas drawn on output
+        self.trails = []    # Trail of every animal of every arena
+        self.last_blobs = []    # last Blob of every animal, keeps identities
+        self.max_stride = max_stride
+        self.gate_cell = max(1, int(max_error * 4))     # tiny frame cell size, see CHANGE_THRESHOLD
+        self.gate_box = None    # arenas bounding box cut to whole cells
+        self.skipped_frames = 0     # frames not detected
+        self.reference_number = 0   # last detected frame
+        self.trajectory_name = trajectory_name
+        self.trajectories = []  # TrajectoryWriter of every animal of every arena
+        self.analytics_name = analytics_name
+        self.analytics = []     # AnimalAnalytics of every animal of every arena
+        self.summaries = []     # analytics summaries after close
+        self.preview = preview
+        self.background_samples = background_samples
+        self.background_method = background_method
+        self.profiler = profiler or Profiler.DISABLED
+        self.frame_pool = BufferPool.FramePool((size[1], size[0], 3))  # frames go back after they are written
+        self.running = True
+        self.cancelled = False  # frames in flight are dropped, see cancel
+        self.error = None   # first exception of pipeline threads, raised by close
+        self.decoded_frames = queue.Queue(prefetch)  # decoder -> tracking threads
+        self.tracked_frames = queue.Queue()  # tracking threads -> writer, in frame order, bounded by window
+        self.decoder = threading.Thread(target=self.decode, name="decoder")
+        self.writer = threading.Thread(target=self.write, name="writer")
+        self.video_writer = None    # encoder thread
+        if output_name:
+            try:
+                self.video_writer = VideoOutput.VideoOutput(output_name, self.fps, output_size or size, codec,
+                                                            profiler=self.profiler, pool=self.frame_pool)
+            except Exception:
+                self.video_reader.release()
+                raise
+
+    def frameAt(self, second):
+        """number of frame shown at second"""
+        if self.index:
+            return self.index.frameAt(second)
+        return int(self.fps * second + 1e-6)
+
+    def frameSecond(self, number):
+        """time of frame in seconds"""
+        if self.index and number < self.index.frame_count:
+            return self.index.timestamps[number] / 1e3
+        return number / self.fps
 
     def getBackground(self):
-        """get background once and set time we need start from"""
-        background = self.video_reader.read()[1]
-        background = cv2.resize(background, self.size)
-        background = cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
-        background = cv2.GaussianBlur(background, (11, 11), 0)
-        self.video_reader.set(cv2.CAP_PROP_POS_FRAMES, self.fps * self.start_second)
+        """get background sampled over range, cached, and set time we need start from"""
+        start, end = self.background_range
+        background = Background.buildBackground(self.input_name, self.size, self.frameAt(start),
+                                                None if end is None else self.frameAt(end) + 1,
+                                                self.background_samples, self.background_method, index=self.index)
+        self.seek(self.first_frame)
         return background
 
+    def seek(self, number):
+        """make next read return frame number"""
+        if self.index:
+            self.index.seek(self.video_reader, number)
+        else:
+            self.video_reader.set(cv2.CAP_PROP_POS_FRAMES, number)
+
+    def setArenas(self, arenas):
+        """prepare trails and trajectory files for every animal of arenas"""
+        self.arenas = arenas
+        self.trails = [[Trail(TRAIL_LENGTH) for animal in range(arena.animals)] for arena in arenas]
+        self.last_blobs = [[None] * arena.animals for arena in arenas]
+        left = min(arena.left for arena in arenas)
+        top = min(arena.top for arena in arenas)
+        cell = self.gate_cell
+        self.gate_box = (left, top, left + max(cell, (max(arena.right for arena in arenas) - left) // cell * cell),
+                         top + max(cell, (max(arena.bottom for arena in arenas) - top) // cell * cell))
+        if self.trajectory_name:
+            self.trajectories = [[Trajectory.TrajectoryWriter(Trajectory.animalName(
+                self.trajectory_name, arena_number if len(arenas) > 1 else None,
+                animal if arena.animals > 1 else None)) for animal in range(arena.animals)]
+                for arena_number, arena in enumerate(arenas)]
+        if self.analytics_name:
+            self.analytics = [[Analytics.AnimalAnalytics(arena.border) for animal in range(arena.animals)]
+                              for arena in arenas]
+
+    def followAnimals(self, arena_number, detections):
+        """match blobs to animals by nearest last position. return Blob or None for every animal of arena"""
+        last_blobs = self.last_blobs[arena_number]
+        animals = [None] * len(last_blobs)
+        used = set()
+        distances = sorted((np.hypot(last.center[0] - detection.center[0], last.center[1] - detection.center[1]),
+                            animal, number)
+                           for animal, last in enumerate(last_blobs) if last is not None
+                           for number, detection in enumerate(detections))
+        for distance, animal, number in distances:
+            if animals[animal] is None and number not in used:
+                animals[animal] = detections[number]
+                used.add(number)
+        free = [animal for animal in range(len(animals)) if animals[animal] is None]
+        for number, detection in enumerate(detections):   # animals not seen before or lost take the rest
+            if number not in used and free:
+                animals[free.pop(0)] = detection
+        for animal, detection in enumerate(animals):
+            if detection is not None:
+                last_blobs[animal] = detection
+        return animals
+
+    def tinyFrame(self, frame, buffers=None, name="tiny"):
+        """arenas box averaged over cells. shift of blob edge changes cell by contrast * shift / cell size
+        buffers - BufferPool.Buffers, result is written into its array of given name"""
+        left, top, right, bottom = self.gate_box
+        size = (right - left) // self.gate_cell, (bottom - top) // self.gate_cell
+        tiny = cv2.resize(frame[top:bottom, left:right], size, dst=buffers and buffers.get("tiny_color",
+                          (size[1], size[0], 3)), interpolation=cv2.INTER_AREA)    # whole cells, fast
+        return cv2.cvtColor(tiny, cv2.COLOR_BGR2GRAY, dst=buffers and buffers.get(name, (size[1], size[0])))
+
+    def start(self):
+        """start decoder and writer threads"""
+        last_frame = self.last_frame
+        if last_frame is None:
+            last_frame = (self.index.frame_count if self.index else
+                          int(self.video_reader.get(cv2.CAP_PROP_FRAME_COUNT))) - 1
+        self.total_frames = max(0, last_frame - self.start_frame + 1)
+        self.decoder.start()
+        self.writer.start()
+
+    def decode(self):
+        """decoder thread. error cancels reader, end of frames is sent anyway"""
+        try:
+            self.decodeFrames()
+        except Exception as error:
+            self.fail(error)
+        self.decoded_frames.put((None, None))    # tell tracking threads to finish
+
+    def decodeFrames(self):
+        """read and resize frames until range or video ends
+        with max stride frames which don't differ from last detected one at tiny resolution skip detection.
+        if nothing is drawn, frames are only grabbed and stride doubles while nothing changes. when sampled frame
+        has changed, decoding goes back and frames after last detected one are read one by one"""
+        profiler = self.profiler
+        gate = self.max_stride > 1
+        grab = gate and self.video_writer is None and self.preview is None
+        reference = None    # tiny frame of last detected frame
+        parity = 0  # tiny frames alternate between two buffers, so reference isn't overwritten
+        buffers = self.frame_pool.buffers()
+        raw = None  # frame of video size, read into same array every time
+        stride = 1
+        while self.running and (self.last_frame is None or
+                                self.first_frame + self.current_frame_out <= self.last_frame):
+            number = self.current_frame_out
+            if grab and stride > 1:
+                if self.last_frame is not None:
+                    stride = min(stride, self.last_frame - self.first_frame - number + 1)
+                grabbed = 0
+                start = profiler.clock()
+                while grabbed < stride - 1 and self.video_reader.grab():
+                    grabbed += 1
+                start = profiler.add("grab", start)
+            else:
+                grabbed = 0
+                start = profiler.clock()
+            is_frame, raw = self.video_reader.read(raw)
+            if not is_frame:
+                for skipped in range(grabbed):    # video ended inside stride
+                    self.setFrame(number + skipped, None, None)
+                self.current_frame_out += grabbed
+                break
+            start = profiler.add("read", start)
+            frame = cv2.resize(raw, self.size, dst=self.frame_pool.get())
+            start = profiler.add("resize", start)
+            if gate:
+                tiny = self.tinyFrame(frame, buffers, "tiny%i" % parity)
+                changed = reference is None or int(cv2.absdiff(tiny, reference).max()) > CHANGE_THRESHOLD
+                start = profiler.add("gate", start)
+                if grab:
+                    if changed and grabbed:     # something moved inside stride, go back
+                        self.seek(self.first_frame + number)
+                        self.frame_pool.put(frame)
+                        stride = 1
+                        continue
+                    for skipped in range(grabbed):
+                        self.setFrame(number + skipped, None, None)
+                    self.skipped_frames += grabbed
+                    number += grabbed
+                    stride = 1 if changed else min(stride * 2, self.max_stride)
+                elif not changed and number - self.reference_number < self.max_stride:
+                    self.waitWindow(number)     # skipped frames are stocked too
+                    self.setFrame(number, frame, None)
+                    self.skipped_frames += 1
+                    self.current_frame_out += 1
+                    continue
+                reference = tiny
+                parity ^= 1
+                self.reference_number = number
+            self.decoded_frames.put((number, frame))
+            profiler.add("decoded_wait", start)
+            self.current_frame_out = number + 1
+
     def getFrame(self):
-        """get frame and frame number"""
+        """get frame and frame number. None if there are no frames left
+        blocks while frame is window frames ahead of the next one to write, so stock of tracked frames is bounded"""
+        start = self.profiler.clock()
+        number, frame = self.decoded_frames.get()
+        self.profiler.add("frame_wait", start)
+        if number is None:
+            self.decoded_frames.put((None, None))    # pass end to the next thread
+            return number, frame
+        self.waitWindow(number)
+        return number, frame
+
+    def waitWindow(self, number):
+        """block while frame is window frames ahead of the next one writer takes. cancel wakes waiting threads"""
         with self.lock:
-            if self.current_second_out > self.end_second:   # out of range
-                return None, None
-            self.current_second_out += 1. / self.fps
-            is_frame, frame = self.video_reader.read()
-            if not is_frame:    # if no return None
-                return None, None
-            return next(self.current_frame_out), cv2.resize(frame, self.size)
+            if number >= self.current_frame_taken + self.window and not self.cancelled:
+                start = self.profiler.clock()
+                stall_start = time.perf_counter()
+                while number >= self.current_frame_taken + self.window and not self.cancelled:
+                    self.frame_given.wait()
+                self.stalls += 1
+                self.stall_seconds += time.perf_counter() - stall_start
+                self.profiler.add("window_wait", start)
 
     def setFrame(self, frame_number, frame_array, point):
-        """write frame and display if need"""
+        """give frames to writer in order. never blocks under lock, writer queue is bounded by window only"""
+        start = self.profiler.clock()
         with self.lock:
+            self.profiler.add("stock_lock_wait", start)
             self.frames_stock[frame_number] = frame_array, point
+            self.max_stock = max(self.max_stock, len(self.frames_stock))
             while self.current_frame_in in self.frames_stock:
-                frame_array, point = self.frames_stock.pop(self.current_frame_in)
-                self.points_stock = self.points_stock[-250:]  # leave last 25 path points only
-                if point is not None:
-                    moments = cv2.moments(point)
-                    x = int(moments["m10"] / moments["m00"])
-                    y = int(moments["m01"] / moments["m00"])
-                    self.points_stock.append((x, y))
-                for i in range(len(self.points_stock) - 1):
-                    cv2.line(frame_array, self.points_stock[i], self.points_stock[i + 1], (0, 0xff, 0xff))
-
-                self.video_writer.write(frame_array)
-                if self.frame_queue:
-                    self.frame_queue.put((self.current_second_in, frame_array))
+                self.tracked_frames.put(self.frames_stock.pop(self.current_frame_in))
                 self.current_frame_in += 1
-                self.current_second_in += 1. / self.fps
+
+    def write(self):
+        """writer thread. decoded frames without detection didn't change, they keep previous positions and are
+        written at once, so full frames are never held. grabbed ones wait for next detected frame and get
+        positions interpolated between detected frames around them.
+        error cancels reader, queue is drained till end anyway, so tracking threads never block"""
+        profiler = self.profiler
+        held = []   # grabbed frames, None placeholders only unless decoded frame follows them
+        while True:
+            start = profiler.clock()
+            item = self.tracked_frames.get()
+            if item is None:
+                break
+            start = profiler.add("tracked_wait", start)
+            with self.lock:
+                self.current_frame_taken += 1
+                self.frame_given.notify_all()
+            if self.cancelled:
+                self.frame_pool.put(item[0])
+                held = []
+                continue
+            frame_array, found = item
+            if found is None:
+                if frame_array is None or held:     # order is kept behind frames waiting for interpolation
+                    held.append(frame_array)
+                    continue
+                try:
+                    self.writeFrame(frame_array, self.interpolate(self.last_blobs, self.last_blobs, 0.))
+                except Exception as error:
+                    self.fail(error)
+                continue
+            try:
+                previous = [list(blobs) for blobs in self.last_blobs]
+                animals = [self.followAnimals(number, blobs) for number, blobs in enumerate(found)]
+                profiler.add("follow", start)
+                for number, held_frame in enumerate(held):  # decoded frames were checked for change, keep position
+                    fraction = (number + 1.) / (len(held) + 1) if held_frame is None else 0.
+                    self.writeFrame(held_frame, self.interpolate(previous, animals, fraction))
+                held = []
+                self.writeFrame(frame_array, animals)
+            except Exception as error:
+                self.fail(error)
+        try:
+            for held_frame in held:     # range ended without change, nothing moved
+                if not self.cancelled:
+                    self.writeFrame(held_frame, self.interpolate(self.last_blobs, self.last_blobs, 0.))
+        except Exception as error:
+            self.fail(error)
+
+    def interpolate(self, previous, animals, fraction):
+        """blobs between previous and next positions of every animal. None if animal is missing at either end
+        fraction 0 keeps previous position, even if animal is lost in next frame"""
+        interpolated = []
+        for arena_previous, arena_animals in zip(previous, animals):
+            interpolated.append([])
+            for before, after in zip(arena_previous, arena_animals):
+                if not fraction and before is not None:    # frame didn't change, outline is still right
+                    interpolated[-1].append(Blob(before.center, before.area, before.outline(), detected=False))
+                    continue
+                if before is None or after is None:
+                    interpolated[-1].append(None)
+                    continue
+                interpolated[-1].append(Blob((before.center[0] + (after.center[0] - before.center[0]) * fraction,
+                                              before.center[1] + (after.center[1] - before.center[1]) * fraction),
+                                             after.area, detected=False))
+        return interpolated
+
+    def writeFrame(self, frame_array, animals):
+        """extend trails, draw paths, write frame and display if need. warmup frames only extend trails
+        frame_array is None if frame wasn't decoded"""
+        profiler = self.profiler
+        start = profiler.clock()
+        for arena_trails, arena_animals in zip(self.trails, animals):
+            for trail, detection in zip(arena_trails, arena_animals):
+                if detection is not None:
+                    trail.append(detection.center)
+        frame_number = self.first_frame + self.current_frame_written
+        warmup = self.current_frame_written < self.warmup_frames
+        for arena_analytics, arena_animals in zip(self.analytics, animals):
+            for analytics, detection in zip(arena_analytics, arena_animals):
+                analytics.add(self.frameSecond(frame_number), None if detection is None else detection.center,
+                              not warmup)
+        if warmup:
+            self.frame_pool.put(frame_array)
+            self.current_frame_written += 1
+            return
+        for arena_trajectories, arena_animals in zip(self.trajectories, animals):
+            for trajectory, detection in zip(arena_trajectories, arena_animals):
+                if detection is None:
+                    trajectory.add(frame_number, self.frameSecond(frame_number))
+                else:
+                    trajectory.add(frame_number, self.frameSecond(frame_number), detection.center, detection.area,
+                                   detection.detected)
+        start = profiler.add("trajectory", start)
+
+        preview = frame_array is not None and self.preview is not None and self.preview.wanted()
+        if frame_array is not None and (self.video_writer is not None or preview):
+            for arena, arena_trails, arena_animals in zip(self.arenas, self.trails, animals):
+                cv2.circle(frame_array, (arena.border[0], arena.border[1]), arena.border[2], (0, 0xff, 0),
+                           thickness=2)
+                for animal, (trail, detection) in enumerate(zip(arena_trails, arena_animals)):
+                    if detection is not None and detection.outline() is not None:
+                        cv2.drawContours(frame_array, [detection.outline()], 0, (0, 0, 255), 2)
+                    trail.draw(frame_array, TRAIL_COLORS[animal % len(TRAIL_COLORS)])
+            start = profiler.add("draw", start)
+        if preview:     # before encoder, which gives frame back to pool
+            self.preview.put(self.frameSecond(frame_number), frame_array)
+            start = profiler.add("preview", start)
+        if frame_array is not None and self.video_writer is not None:
+            if self.video_writer.error is not None:     # encoder failed, cancel job
+                raise self.video_writer.error
+            self.video_writer.write(frame_array)
+            profiler.add("encoder_put_wait", start)
+        else:
+            self.frame_pool.put(frame_array)
+        self.current_frame_written += 1
 
     def stop(self):
-        """finish recording"""
+        """stop decoding. frames already decoded are still written"""
+        self.running = False
+
+    def cancel(self):
+        """stop decoding and drop frames in flight instead of tracking and writing them. threads finish after
+        frames they hold, output files end at last written frame"""
+        self.cancelled = True
+        self.running = False
+        with self.lock:     # wake threads waiting for window
+            self.frame_given.notify_all()
+
+    def fail(self, error):
+        """remember first error of pipeline thread and cancel job. close raises it"""
         with self.lock:
-            if self.video_writer.isOpened():
+            if self.error is None:
+                self.error = error
+        self.cancel()
+
+    def close(self):
+        """wait for writer and finish recording. raise first error of pipeline threads"""
+        self.tracked_frames.put(None)
+        if self.writer.is_alive():
+            self.writer.join()
+        try:
+            if self.video_writer is not None:
                 self.video_writer.release()
+        except Exception as error:
+            self.fail(error)
+        try:
+            for arena_trajectories in self.trajectories:
+                for trajectory in arena_trajectories:
+                    trajectory.close()
+            self.summaries = [dict(analytics.summary(), arena=arena_number, animal=animal)
+                              for arena_number, arena_analytics in enumerate(self.analytics)
+                              for animal, analytics in enumerate(arena_analytics)]
+            if self.analytics_name:
+                Analytics.writeSummaries(self.analytics_name, self.summaries)
+        except Exception as error:
+            self.fail(error)
+        self.video_reader.release()
+        if self.error is not None:
+            raise self.error
 
 
-def threadProceed(video_reader, background, border, mask):
-    """thread for mouse tracking
-    background - first frame. gray
-    border - circle or None, made for drawing on frame
-    mask - boolean matrix for filters"""
+class Arena(object):
+    """circle arena with one or more animals"""
+    MARGIN = 16     # blur radius + dilation iterations + 1. keeps results inside circle same as for full frame
 
-    def checkContour(contour):
-        """analyze contours for border and return true if contour is good"""
-        for line in contour:
-            x = line[0][0] - border[0]
-            y = line[0][1] - border[1]
-            length = math.sqrt(x ** 2 + y ** 2)
-            if length / border[2] >= .99:
-                return False
-        return True
+    def __init__(self, center, radius, size, animals=1):
+        """center and radius are relative to frame size (width, height)"""
+        width, height = size
+        x = int(center[0] * width)
+        y = int(center[1] * height)
+        radius = int(radius * width)
+        self.border = [x, y, radius]
+        self.animals = animals
+        self.left = max(0, x - radius - self.MARGIN)
+        self.top = max(0, y - radius - self.MARGIN)
+        self.right = max(self.left + 1, min(width, x + radius + self.MARGIN + 1))
+        self.bottom = max(self.top + 1, min(height, y + radius + self.MARGIN + 1))
 
-    while video_reader.video_writer.isOpened():
+    def place(self, region):
+        """prepare box, mask and border ring in detection coordinates of region"""
+        x, y, radius = self.border
+        scale_x, scale_y = region.scales
+        self.box_left = int(round((self.left - region.left) * scale_x))
+        self.box_top = int(round((self.top - region.top) * scale_y))
+        self.box_right = max(self.box_left + 1, min(region.size[0], int(round((self.right - region.left) * scale_x))))
+        self.box_bottom = max(self.box_top + 1, min(region.size[1], int(round((self.bottom - region.top) * scale_y))))
+        self.mask = np.zeros((self.box_bottom - self.box_top, self.box_right - self.box_left), dtype=np.uint8)
+        center = (int(round((x - region.left) * scale_x)) - self.box_left,
+                  int(round((y - region.top) * scale_y)) - self.box_top)
+        if scale_x == scale_y:
+            cv2.circle(self.mask, center, int(round(radius * scale_x)), (0xff, ), thickness=-1)
+        else:   # rounded detection size stretches axes a little differently
+            cv2.ellipse(self.mask, center, (int(round(radius * scale_x)), int(round(radius * scale_y))), 0, 0, 360,
+                        (0xff, ), thickness=-1)
+        rows, columns = np.ogrid[self.box_top:self.box_bottom, self.box_left:self.box_right]
+        rows = (rows + .5) / scale_y - .5 + region.top   # frame coordinates of detection pixels
+        columns = (columns + .5) / scale_x - .5 + region.left
+        self.ring = np.sqrt((columns - x) ** 2 + (rows - y) ** 2) / max(radius, 1) >= .99  # contours touching border
 
-        number, original = video_reader.getFrame()
-        if number is None:
-            break
+    def crop(self, frame):
+        """arena box view of region detection frame"""
+        return frame[self.box_top:self.box_bottom, self.box_left:self.box_right]
+
+
+class Region(object):
+    """bounding box of all arenas. filters run on it once for all arenas, scaled by detection scale"""
+
+    def __init__(self, arenas, background, scale=1., engine="contours"):
+        """background - full gray frame, scale - detection resolution relative to frame, contours are scaled back
+        engine - ENGINES key, how blobs are found on thresholded frame"""
+        self.arenas = arenas
+        self.engine = engine
+        self.left = min(arena.left for arena in arenas)
+        self.top = min(arena.top for arena in arenas)
+        self.right = max(arena.right for arena in arenas)
+        self.bottom = max(arena.bottom for arena in arenas)
+        self.scale = scale
+        self.size = (max(1, int(round((self.right - self.left) * scale))),
+                     max(1, int(round((self.bottom - self.top) * scale))))
+        self.scales = (self.size[0] / (self.right - self.left),     # actual ratios of rounded size, mapping back
+                       self.size[1] / (self.bottom - self.top))     # with nominal scale shifts far points
+        self.blur = max(1, int(11 * scale)) | 1    # odd kernel size
+        self.iterations = max(1, int(round(10 * scale)))
+        self.background = self.shrink(self.crop(background))
+        for arena in arenas:
+            arena.place(self)
+
+    def crop(self, frame):
+        """bounding box view of frame"""
+        return frame[self.top:self.bottom, self.left:self.right]
+
+    def shrink(self, frame, buffers=None):
+        """scale cropped frame to detection size. buffers - BufferPool.Buffers for result"""
+        if self.scale == 1:
+            return frame
+        return cv2.resize(frame, self.size, dst=buffers and buffers.get("shrink", (self.size[1], self.size[0])),
+                          interpolation=cv2.INTER_LINEAR)   # area is slow for odd factors
+
+    def toFrame(self, contour, arena):
+        """convert contour from arena detection box to frame coordinates"""
+        return detectionToFrame(contour, (arena.box_left, arena.box_top), self.scales, (self.left, self.top))
+
+    def pointToFrame(self, point, offset):
+        """convert float point from detection box at offset to frame coordinates"""
+        if self.scale == 1:
+            return point[0] + offset[0] + self.left, point[1] + offset[1] + self.top
+        return ((point[0] + offset[0] + .5) / self.scales[0] - .5 + self.left,
+                (point[1] + offset[1] + .5) / self.scales[1] - .5 + self.top)
+
+
+def detectionToFrame(contour, offset, scales, origin):
+    """convert integer points from detection box at offset of region at origin to frame coordinates
+    scales - (x, y) ratios of detection to frame size"""
+    contour = contour + offset
+    if scales != (1, 1):
+        contour = np.floor((contour + .5) / scales).astype(np.int32)  # floor(x - .5 + .5), round keeps halves even
+    return contour + origin
+
+
+class Blob(object):
+    """detected animal in frame coordinates. outline is traced from blob mask only when blob is drawn
+    contour - outline if it's known already, otherwise mask with offset in region and region scales and origin
+    interpolated blob has neither"""
+
+    def __init__(self, center, area, contour=None, mask=None, offset=(0, 0), scales=(1, 1), origin=(0, 0),
+                 detected=True):
+        self.center = center
+        self.area = area
+        self.detected = detected    # False if position is interpolated
+        self.contour = contour
+        self.mask = mask
+        self.offset = offset
+        self.scales = scales
+        self.origin = origin
 
-        if border is not None:
-            cv2.circle(original, (border[0], border[1]), border[2], (0, 0xff, 0), thickness=2)
+    def outline(self):
+        """contour in frame coordinates or None for interpolated blob"""
+        if self.contour is None and self.mask is not None:
+            contours = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+            self.contour = detectionToFrame(contours[0], self.offset, self.scales, self.origin)
+        return self.contour
 
-        frame = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)  # convert to gray
-        frame = cv2.GaussianBlur(frame, (11, 11), 0)    # smooth
-        frame = cv2.absdiff(frame, background)  # find difference
-        # video_reader.setFrame(number, cv2.merge((frame, frame, frame)), None)
 
-        frame = cv2.threshold(frame, 20, 255, cv2.THRESH_BINARY)[1]     # remove small difference
-        frame = cv2.dilate(frame, None, iterations=10)   # swell mouse
-        frame &= mask   # remove outside borders
-        contours = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]  # find contours
-        contours.sort(key=lambda x: cv2.contourArea(x), reverse=True)   # sort by size
+def checkContour(contour, arena):
+    """analyze contours for border and return true if contour is good. contour in arena detection box"""
+    points = contour.reshape(-1, 2)
+    return not arena.ring[points[:, 1], points[:, 0]].any()
 
-        for contour in contours:
-            if checkContour(contour):
-                cv2.drawContours(original, [contour], 0, (0, 0, 255), 2)
-                video_reader.setFrame(number, original, contour)
+
+def contourBlobs(frame, arena, region, profiler):
+    """largest contours not touching border. contours of whole hierarchy are candidates, area of outline polygon"""
+    start = profiler.clock()
+    contours = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]  # opencv 3 and 4 order
+    contours = sorted(contours, key=lambda x: cv2.contourArea(x), reverse=True)   # sort by size
+    start = profiler.add("contours", start)
+    animals = []
+    for contour in contours:
+        if checkContour(contour, arena):
+            animals.append(contour)
+            if len(animals) == arena.animals:
                 break
-        else:
-            video_reader.setFrame(number, original, None)
+    blobs = []
+    for contour in animals:
+        moments = cv2.moments(contour)  # in detection box, center is mapped as float, not from rounded outline
+        if moments["m00"]:
+            blobs.append(Blob(region.pointToFrame((moments["m10"] / moments["m00"], moments["m01"] / moments["m00"]),
+                                                  (arena.box_left, arena.box_top)),
+                              moments["m00"] / (region.scales[0] * region.scales[1]), region.toFrame(contour, arena)))
+    profiler.add("check", start)
+    return blobs
 
 
-def startTracking(video_reader, center, radius):
-    """main thread for tracking mouse"""
-    background = video_reader.getBackground()
+def componentBlobs(frame, arena, region, profiler):
+    """largest connected components not touching border. areas, boxes and centroids come from single call,
+    border is checked for all labels at once. area is pixel count, center is pixel centroid
+    labeling runs on bounding box of non zero pixels only, it costs per pixel unlike contour tracing"""
+    start = profiler.clock()
+    left, top, width, height = cv2.boundingRect(frame)
+    if not width:
+        return []
+    frame = frame[top:top + height, left:left + width]
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(frame, connectivity=8)
+    start = profiler.add("components", start)
+    areas = stats[:, cv2.CC_STAT_AREA].copy()
+    areas[0] = 0    # background
+    touching = np.bincount(labels[arena.ring[top:top + height, left:left + width]], minlength=count) > 0
+    areas[touching] = 0
+    left += arena.box_left  # region detection coordinates
+    top += arena.box_top
+    blobs = []
+    for label in np.argsort(-areas, kind="stable")[:arena.animals]:
+        if not areas[label]:
+            break
+        x, y, width, height = stats[label, :4]
+        offset = left + x, top + y
+        blobs.append(Blob(region.pointToFrame(centroids[label], (left, top)),
+                          areas[label] / (region.scales[0] * region.scales[1]),
+                          mask=(labels[y:y + height, x:x + width] == label).view(np.uint8), offset=offset,
+                          scales=region.scales, origin=(region.left, region.top)))
+    profiler.add("check", start)
+    return blobs
+
 
-    mask = np.zeros(background.shape, dtype=np.uint8)
-    x = int(center[0] * background.shape[1])
-    y = int(center[1] * background.shape[0])
-    radius = int(radius * background.shape[1])
-    cv2.circle(mask, (x, y), radius, (0xff, ), thickness=-1)
-    circle = [x, y, radius]
+ENGINES = {"contours": contourBlobs, "components": componentBlobs}
 
-    # circle, mask = findCircleMask(background)
-    # cv2.imshow("w", mask)
-    # cv2.waitKey()
-    # cv2.destroyAllWindows()
 
-    threads = []
-    for i in range(8):  # 8 threads is most optimal +100% of speed
-        threads.append(threading.Thread(target=threadProceed, args=(video_reader, background, circle, mask)))
-    for thread in threads:
-        thread.start()
-    for thread in threads:
-        thread.join()
-    video_reader.stop()
+def detectMice(original, region, profiler=None, buffers=None):
+    """find animals on frame in every arena of region. gray, blur and diff are done once for all arenas
+    buffers - BufferPool.Buffers of calling thread, filters write into its arrays instead of new ones
+    return list of Blob for every arena, largest first"""
+    profiler = profiler or Profiler.DISABLED
+    buffers = buffers or BufferPool.Buffers()
+    shape = region.size[1], region.size[0]
+    start = profiler.clock()
+    frame = region.crop(original)
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.get("gray", frame.shape[:2]))  # convert to gray
+    start = profiler.add("gray", start)
+    frame = region.shrink(frame, buffers)     # detection resolution
+    start = profiler.add("shrink", start)
+    frame = cv2.GaussianBlur(frame, (region.blur, region.blur), 0, dst=buffers.get("blur", shape))    # smooth
+    start = profiler.add("blur", start)
+    frame = cv2.absdiff(frame, region.background, dst=buffers.get("diff", shape))  # find difference
+    start = profiler.add("absdiff", start)
+
+    frame = cv2.threshold(frame, 20, 255, cv2.THRESH_BINARY, dst=frame)[1]     # remove small difference
+    start = profiler.add("threshold", start)
+    frame = cv2.dilate(frame, None, dst=buffers.get("dilate", shape), iterations=region.iterations)   # swell mouse
+    profiler.add("dilate", start)
+    find = ENGINES[region.engine]
+    found = []
+    for number, arena in enumerate(region.arenas):
+        start = profiler.clock()
+        arena_frame = cv2.bitwise_and(arena.crop(frame), arena.mask,
+                                      dst=buffers.get("mask%i" % number, arena.mask.shape))  # remove outside borders
+        profiler.add("mask", start)
+        found.append(find(arena_frame, arena, region, profiler))
+    return found
+
+
+def threadProceed(video_reader, region):
+    """thread for mouse tracking. detection only, decoding and drawing are done by video reader threads"""
+    buffers = video_reader.frame_pool.buffers()
+    while True:
+        number, original = video_reader.getFrame()
+        if number is None:
+            break
+        found = None
+        if not video_reader.cancelled:
+            try:
+                found = detectMice(original, region, video_reader.profiler, buffers)
+            except Exception as error:  # frame must still reach writer, or reorder window stops
+                video_reader.fail(error)
+        if found is None:   # cancelled or failed, frame is dropped
+            video_reader.frame_pool.put(original)
+            video_reader.setFrame(number, None, None)
+        else:
+            video_reader.setFrame(number, original, found)
+
+
+def startTracking(video_reader, center=None, radius=None, threads=8, processes=0, detection_scale=1., arenas=None,
+                  animals=1, engine="contours"):
+    """main thread for tracking mouse. return number of frames written
+    processes - use detector processes with shared memory frames instead of threads if not 0
+    detection_scale - run filters on downscaled frame, overlay is still drawn on full frame
+    arenas - list of (center, radius) or (center, radius, animals) tracked in one pass instead of center and radius
+    animals - animals per arena if arena doesn't tell
+    engine - "contours" or "components", connected components are faster, areas are pixel counts"""
+    background = video_reader.getBackground()
+    size = background.shape[1], background.shape[0]
+    if arenas is None:
+        arenas = [(center, radius)]
+    arenas = [Arena(arena[0], arena[1], size, arena[2] if len(arena) > 2 else animals) for arena in arenas]
+    region = Region(arenas, background, detection_scale, engine)
+
+    video_reader.setArenas(arenas)
+    video_reader.start()
+    try:
+        if processes:
+            ProcessTracker.processTracking(video_reader, detectMice, (region, None, BufferPool.Buffers()),
+                                           processes)  # every process gets own copy of buffers
+        else:
+            workers = []
+            for i in range(threads):  # 8 threads is most optimal +100% of speed
+                workers.append(threading.Thread(target=threadProceed, args=(video_reader, region),
+                                                name="tracker%i" % i))
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+    finally:
+        video_reader.close()
+    return max(0, video_reader.current_frame_written - video_reader.warmup_frames)
 
 
 if __name__ == "__main__":
-    a = VideoReader("D:/downloads/videoplayback.mp4", "D:/a.avi", end=10)
-    startTracking(a)
+    import BatchTracker
+    sys.exit(BatchTracker.main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class FrameRing(object):
+    """ring of frame slots in shared memory. processes get slot number instead of pickled frame"""
+
+    def __init__(self, slots, shape):
+        self.shape = (slots, ) + tuple(shape)
+        self.memory = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self.frames = np.ndarray(self.shape, dtype=np.uint8, buffer=self.memory.buf)
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+
+    def put(self, frame):
+        """copy frame into free slot. block until slot released. return slot number"""
+        slot = self.free_slots.get()
+        self.frames[slot] = frame
+        return slot
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def close(self):
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+def processProceed(detect, memory_name, shape, tasks, results, args):
+    """process for mouse tracking. read frame from shared slot and return contour only, or error of frame"""
+    memory = shared_memory.SharedMemory(name=memory_name)
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        number, slot = task
+        try:
+            results.put((number, slot, detect(frames[slot], *args), None))
+        except Exception as error:  # frame must still be answered, or reorder window stops
+            results.put((number, slot, None, error))
+    results.put(None)   # tell parent process finished
+    del frames
+    memory.close()
+
+
+def processTracking(video_reader, detect, args, processes):
+    """track frames of video reader with detector processes. blocks until all frames are given to writer
+    detect - picklable function called as detect(frame, *args) in detector process"""
+    # reader threads are already running, forked child would inherit their locks in any state. forkserver
+    # starts children from clean server process, windows has spawn only
+    context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                                          else None)
+    ring = FrameRing(processes * 2, (video_reader.size[1], video_reader.size[0], 3))
+    tasks = context.Queue()
+    results = context.Queue()
+    originals = {}  # frame number -> frame, kept in this process for writer
+    crashed = threading.Event()
+    profiler = video_reader.profiler    # detector process stages are not recorded, only waits for them
+
+    def dispatch():
+        """send frames to detector processes"""
+        while True:
+            number, original = video_reader.getFrame()
+            if number is None:
+                break
+            if crashed.is_set() or video_reader.cancelled:  # drop frames till decoder stops
+                video_reader.frame_pool.put(original)
+                video_reader.setFrame(number, None, None)   # moves reorder window, so decoder isn't blocked
+                continue
+            originals[number] = original
+            start = profiler.clock()
+            slot = ring.put(original)
+            profiler.add("slot_wait", start)
+            tasks.put((number, slot))
+        for i in range(processes):
+            tasks.put(None)
+
+    try:
+        workers = [context.Process(target=processProceed,
+                                   args=(detect, ring.memory.name, ring.shape, tasks, results, args))
+                   for i in range(processes)]
+        for worker in workers:
+            worker.start()
+        dispatcher = threading.Thread(target=dispatch, name="dispatcher")
+        dispatcher.start()
+
+        finished = 0
+        while finished < processes:
+            start = profiler.clock()
+            try:
+                result = results.get(timeout=1)
+                profiler.add("result_wait", start)
+            except queue.Empty:
+                result = False
+            dead = any(worker.exitcode not in (None, 0) for worker in workers)  # its frames will never come
+            if dead or result is False and not any(worker.is_alive() for worker in workers):
+                crashed.set()
+                video_reader.cancel()   # wakes threads waiting for window, frames in flight are dropped
+                ring.release(0)     # wake dispatcher waiting for slot
+                for worker in workers:  # survivors could block on full result queue
+                    if worker.is_alive():
+                        worker.terminate()
+                break
+            if result is False:
+                continue
+            if result is None:
+                finished += 1
+                continue
+            number, slot, contour, error = result
+            ring.release(slot)
+            if error is not None:
+                video_reader.fail(error)
+                video_reader.frame_pool.put(originals.pop(number))
+                video_reader.setFrame(number, None, None)
+            else:
+                video_reader.setFrame(number, originals.pop(number), contour)
+
+        dispatcher.join()
+        for worker in workers:
+            worker.join()
+    finally:    # shared memory outlives process otherwise
+        ring.close()
+    if crashed.is_set():
+        raise RuntimeError("detector processes crashed")
@@ -0,0 +1,115 @@
+import time
+import threading
+
+
+class Stage(object):
+    """latency histogram of one stage. bin i counts durations below 2 ** i microseconds"""
+    BINS = 26   # up to about a minute
+
+    def __init__(self):
+        self.counts = [0] * self.BINS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), self.BINS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, share):
+        """upper bound of histogram bin holding share of durations, seconds"""
+        rank = share * self.count
+        passed = 0
+        for number, count in enumerate(self.counts):
+            passed += count
+            if passed >= rank:
+                return min(2 ** number / 1e6, self.max)
+        return self.max
+
+
+class Profiler(object):
+    """opt-in per stage timing of tracking threads. every thread records into its own stages, so hot path is not
+    locked. disabled profiler returns from clock and add at once
+    usage: start = profiler.clock(); ...; start = profiler.add("stage", start); ...; profiler.add("next", start)
+    stages named *_wait are time spent blocked on locks and queues"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.local = threading.local()
+        self.threads = {}   # thread name -> stage name -> Stage
+        self.lock = threading.Lock()
+        self.progress_point = time.perf_counter(), 0     # time and frames of last progress call
+
+    def clock(self):
+        return time.perf_counter() if self.enabled else 0.
+
+    def add(self, name, start):
+        """record stage which began at clock value. return clock value for next stage"""
+        if not self.enabled:
+            return 0.
+        now = time.perf_counter()
+        stages = getattr(self.local, "stages", None)
+        if stages is None:
+            stages = self.local.stages = {}
+            with self.lock:
+                self.threads[threading.current_thread().name] = stages
+        stage = stages.get(name)
+        if stage is None:
+            stage = stages[name] = Stage()
+        stage.add(now - start)
+        return now
+
+    def stages(self):
+        """stages of all threads merged by name"""
+        merged = {}
+        with self.lock:
+            threads = list(self.threads.values())
+        for stages in threads:
+            for name, stage in list(stages.items()):
+                merged.setdefault(name, Stage()).merge(stage)
+        return merged
+
+    def progress(self, done, total=None):
+        """frames, frames per second since previous call and estimated time left"""
+        now = time.perf_counter()
+        last_time, last_done = self.progress_point
+        self.progress_point = now, done
+        fps = (done - last_done) / max(now - last_time, 1e-6)
+        text = "%i/%s frames, %.1f fps" % (done, total if total else "?", fps)
+        if total and fps > 0:
+            left = max(total - done, 0) / fps
+            text += ", ETA %i:%02i" % (left // 60, left % 60)
+        return text
+
+    def summary(self):
+        """stage breakdown and waits of every thread as text table"""
+        if not self.enabled:
+            return ""
+        stages = self.stages()
+        lines = ["%-16s %7s %8s %8s %8s %8s %8s" % ("stage", "count", "mean ms", "p50 ms", "p95 ms", "max ms",
+                                                     "total s")]
+        for name, stage in sorted(stages.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append("%-16s %7i %8.3f %8.3f %8.3f %8.3f %8.2f" % (
+                name, stage.count, stage.total * 1e3 / max(stage.count, 1), stage.percentile(.5) * 1e3,
+                stage.percentile(.95) * 1e3, stage.max * 1e3, stage.total))
+        with self.lock:
+            threads = sorted(self.threads.items())
+        lines.append("waits per thread:")
+        for thread, thread_stages in threads:
+            waits = ["%s %.2fs" % (name, stage.total) for name, stage in sorted(list(thread_stages.items()))
+                     if name.endswith("_wait")]
+            if waits:
+                lines.append("  %s: %s" % (thread, ", ".join(waits)))
+        return "\n".join(lines)
+
+
+DISABLED = Profiler(False)  # default of functions taking profiler
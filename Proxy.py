@@ -0,0 +1,109 @@
+import os
+import cv2
+import numpy as np
+import Cache
+
+
+PROXY_SIZE = 640, 360
+PROXY_RATE = 2.     # thumbnails per second
+METADATA_MARGIN = 1.05  # container frame count and fps are estimates, proxy sized by them gets spare thumbnails
+
+
+class Proxy(object):
+    """small thumbnails of video taken rate times per second, memory mapped from cache file.
+    gui scrubs and picks arena on them, full video is decoded only for rendering.
+    thumbnail k is first frame at or after k / rate seconds"""
+
+    def __init__(self, frames, rate, ready=None, cache_name=None):
+        """frames - memory mapped array (count, height, width, 3), ready - thumbnails filled so far"""
+        self.frames = frames
+        self.rate = rate
+        self.ready = len(frames) if ready is None else ready
+        self.cache_name = cache_name    # cache file being built, None if proxy is loaded from cache
+        self.stopped = False
+
+    def frameAt(self, second):
+        """nearest thumbnail or None if it's not built yet"""
+        number = min(int(second * self.rate + .5), len(self.frames) - 1)
+        if not 0 <= number < self.ready:
+            return None
+        return self.frames[number]
+
+    def stop(self):
+        self.stopped = True
+
+    def fill(self, frame):
+        """resize frame into next thumbnail"""
+        cv2.resize(frame, (self.frames.shape[2], self.frames.shape[1]), dst=self.frames[self.ready],
+                   interpolation=cv2.INTER_AREA)
+        self.ready += 1
+
+    def visit(self, capture, number, milliseconds):
+        """VideoIndex.buildIndex hook. grabbed frame is retrieved only if it's due thumbnail, so proxy is taken
+        in the same pass as index"""
+        first = self.ready
+        while not self.stopped and self.ready < len(self.frames) and \
+                milliseconds >= self.ready * 1e3 / self.rate - 1e-3:
+            if self.ready > first:  # frame is due for several thumbnails of video slower than rate
+                self.frames[self.ready] = self.frames[self.ready - 1]
+                self.ready += 1
+                continue
+            is_frame, frame = capture.retrieve()
+            if not is_frame:
+                break
+            self.fill(frame)
+
+    def build(self, video_name, index):
+        """fill thumbnails missed by index pass, meant for background thread. frames between thumbnails are
+        grabbed, not converted. thumbnails are readable by frameAt as soon as they are filled.
+        count file is saved only if proxy holds all thumbnails of index"""
+        if self.cache_name is None:
+            return
+        count = int(index.timestamps[-1] / 1e3 * self.rate) + 1 if index.frame_count else 0
+        if self.ready < min(count, len(self.frames)):
+            capture = cv2.VideoCapture(video_name)
+            position = 0    # frame next grab returns
+            for number in range(self.ready, min(count, len(self.frames))):
+                if self.stopped:
+                    break
+                target = min(int(np.searchsorted(index.timestamps, number * 1e3 / self.rate - 1e-3)),
+                             index.frame_count - 1)
+                while position <= target and capture.grab():
+                    position += 1
+                if position <= target:  # video is shorter than index says
+                    break
+                is_frame, frame = capture.retrieve()
+                if not is_frame:
+                    break
+                self.fill(frame)
+            capture.release()
+        self.frames.flush()
+        if not self.stopped and len(self.frames) >= count:     # too short proxy is sized by index next time
+            temporary_name = Cache.temporaryName(self.cache_name + ".count")
+            with open(temporary_name, "w") as count_file:
+                count_file.write(str(self.ready))
+            os.replace(temporary_name, self.cache_name + ".count")
+            self.frames = self.frames[:self.ready]  # spare thumbnails of metadata estimate
+        self.cache_name = None
+
+
+def openProxy(video_name, index=None, size=PROXY_SIZE, rate=PROXY_RATE):
+    """cached proxy or empty one to build. index gives exact duration, without it proxy is sized by container
+    metadata and filled by visit while index is built. None if video has no usable metadata.
+    frames file is mapped while it's built, so count file written afterwards marks it complete"""
+    cache_name = Cache.cacheName(video_name, "proxy.npy", tuple(size), rate)
+    if os.path.isfile(cache_name + ".count") and os.path.isfile(cache_name):
+        with open(cache_name + ".count") as count_file:
+            count = int(count_file.read())
+        return Proxy(np.load(cache_name, mmap_mode="r")[:count], rate)
+    if index is not None:
+        count = int(index.timestamps[-1] / 1e3 * rate) + 1 if index.frame_count else 0
+    else:
+        capture = cv2.VideoCapture(video_name)
+        frame_count, fps = capture.get(cv2.CAP_PROP_FRAME_COUNT), capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        count = int(frame_count / fps * rate * METADATA_MARGIN) + 2 if frame_count > 0 and fps > 0 else 0
+    if not count:
+        return None
+    frames = np.lib.format.open_memmap(cache_name, mode="w+", dtype=np.uint8, shape=(count, size[1], size[0], 3))
+    return Proxy(frames, rate, 0, cache_name)
@@ -0,0 +1,168 @@
+import time
+import threading
+import MouseTracker
+import Profiler
+import Analytics
+
+
+class RenderJob(object):
+    """one gui render. reader is created when job starts, so queued jobs hold no decoder or buffers
+    arenas - list of (center, radius) or (center, radius, animals), see startTracking"""
+    QUEUED, RUNNING, FINISHED, CANCELLED, FAILED = "queued", "running", "finished", "cancelled", "failed"
+
+    def __init__(self, input_name, output_name, start, end, arenas, trajectory_name=None, analytics_name=None,
+                 index=None, profile=False, size=(1280, 720)):
+        self.input_name = input_name
+        self.output_name = output_name
+        self.start = start
+        self.end = end
+        self.arenas = arenas
+        self.trajectory_name = trajectory_name
+        self.analytics_name = analytics_name
+        self.index = index
+        self.profiler = Profiler.Profiler(profile)
+        self.size = size
+        self.state = self.QUEUED
+        self.preview = None     # PreviewChannel while job owns it
+        self.video_reader = None
+        self.cancelled = False
+        self.error = None
+        self.seconds = 0.
+        self.start_time = None
+
+    def run(self):
+        """render thread"""
+        self.start_time = time.monotonic()
+        try:
+            self.video_reader = MouseTracker.VideoReader(self.input_name, self.output_name, size=self.size,
+                                                         start=self.start, end=self.end, preview=self.preview,
+                                                         trajectory_name=self.trajectory_name, index=self.index,
+                                                         profiler=self.profiler, analytics_name=self.analytics_name)
+            self.video_reader.preview = self.preview    # preview may be given while reader was opened
+            if self.cancelled:
+                self.video_reader.cancel()
+            if not self.video_reader.video_reader.isOpened():
+                raise IOError("can't open video")
+            MouseTracker.startTracking(self.video_reader, arenas=self.arenas)
+            self.state = self.CANCELLED if self.cancelled else self.FINISHED
+        except Exception as error:  # keep queue running, show failed job
+            self.error = "%s: %s" % (type(error).__name__, error)
+            self.state = self.FAILED
+        self.seconds = time.monotonic() - self.start_time
+
+    def setPreview(self, preview):
+        """writer reads preview every frame, so it can be given to running job"""
+        self.preview = preview
+        if self.video_reader is not None:
+            self.video_reader.preview = preview
+
+    def cancel(self):
+        """queued job never starts, running one drops frames in flight and finishes promptly"""
+        self.cancelled = True
+        if self.state == self.QUEUED:
+            self.state = self.CANCELLED
+        video_reader = self.video_reader
+        if video_reader is not None:
+            video_reader.cancel()
+
+    def done(self):
+        return self.state not in (self.QUEUED, self.RUNNING)
+
+    def written(self):
+        """frames written so far, warmup excluded"""
+        video_reader = self.video_reader
+        if video_reader is None:
+            return 0
+        return max(0, video_reader.current_frame_written - video_reader.warmup_frames)
+
+    def progress(self):
+        """one line of state, frames and throughput"""
+        if self.state == self.RUNNING:
+            return self.profiler.progress(self.written(), self.video_reader and self.video_reader.total_frames)
+        if self.state in (self.FINISHED, self.CANCELLED):
+            return "%s. %i frames, %.1fs, %.1f fps" % (self.state, self.written(), self.seconds,
+                                                       self.written() / max(self.seconds, 1e-6))
+        if self.state == self.FAILED:
+            return "failed. %s" % self.error
+        return self.state
+
+    def summary(self):
+        """analytics and stage breakdown of finished job"""
+        if self.video_reader is None or not self.done():
+            return ""
+        return "\n".join(text for text in (Analytics.summaryText(self.video_reader.summaries),
+                                           self.profiler.summary()) if text)
+
+
+class RenderQueue(object):
+    """runs queued render jobs, at most concurrency at once. every job has its own reader, so jobs share nothing
+    but preview, which is given to the oldest running job"""
+
+    def __init__(self, concurrency=1, preview=None):
+        self.concurrency = concurrency
+        self.preview = preview
+        self.jobs = []
+        self.preview_job = None     # job drawing preview
+        self.lock = threading.Lock()
+        self.threads = []   # render threads ever started, not daemons, so exit waits till outputs are closed
+
+    def add(self, job):
+        with self.lock:
+            self.jobs.append(job)
+        self.schedule()
+
+    def setConcurrency(self, concurrency):
+        self.concurrency = max(1, concurrency)
+        self.schedule()
+
+    def running(self):
+        return [job for job in self.jobs if job.state == RenderJob.RUNNING]
+
+    def busy(self):
+        """true while some job is queued or running"""
+        return any(not job.done() for job in self.jobs)
+
+    def schedule(self):
+        """start queued jobs while there are free slots"""
+        with self.lock:
+            running = self.running()
+            for job in self.jobs:
+                if len(running) >= self.concurrency:
+                    break
+                if job.state != RenderJob.QUEUED:
+                    continue
+                job.state = RenderJob.RUNNING
+                if self.preview_job is None:
+                    self.preview_job = job
+                    job.setPreview(self.preview)
+                running.append(job)
+                thread = threading.Thread(target=self.runJob, args=(job, ), name="render%i" % len(self.threads))
+                self.threads.append(thread)
+                thread.start()
+
+    def runJob(self, job):
+        """render thread. preview and slot go to next jobs afterwards, stage breakdown is printed"""
+        job.run()
+        breakdown = job.profiler.summary()
+        if breakdown:
+            print("%s\n%s" % (job.output_name, breakdown))
+        with self.lock:
+            if self.preview_job is job:
+                job.setPreview(None)
+                running = self.running()
+                self.preview_job = running[0] if running else None
+                if running:
+                    running[0].setPreview(self.preview)
+        self.schedule()
+
+    def cancel(self, jobs=None):
+        """cancel given jobs or all unfinished ones"""
+        for job in list(self.jobs) if jobs is None else jobs:
+            if not job.done():
+                job.cancel()
+
+    def close(self):
+        """cancel all jobs and wait for render threads, output files end at last written frame"""
+        self.cancel()
+        for thread in list(self.threads):
+            thread.join()
@@ -0,0 +1,113 @@
+import os
+import struct
+import numpy as np
+
+
+FIELDS = np.dtype([("frame", np.int64),
+                   ("time", np.float64),
+                   ("x", np.float32),
+                   ("y", np.float32),
+                   ("area", np.float32),
+                   ("detected", np.bool_)])
+
+
+class TrajectoryWriter(object):
+    """streams per frame positions into .csv or .npy file. rows are written in batches
+    npy file is structured array with FIELDS columns, load it with numpy.load(name, mmap_mode="r")"""
+    HEADER_SIZE = 256   # npy header is rewritten in place with final row count
+
+    def __init__(self, file_name, batch=4096):
+        self.file_name = file_name
+        self.format = os.path.splitext(file_name)[1].lower()
+        if self.format not in (".csv", ".npy"):
+            raise ValueError("trajectory file must be .csv or .npy")
+        self.rows = np.zeros(batch, dtype=FIELDS)
+        self.count = 0  # rows in batch
+        self.written = 0    # rows in file
+        self.file = open(file_name, "wb")
+        if self.format == ".npy":
+            self.file.write(self.header())
+        else:
+            self.file.write(b"frame,time,x,y,area,detected\n")
+
+    def header(self):
+        """npy version 1.0 header of fixed size"""
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%i,), }" % (
+            np.lib.format.dtype_to_descr(FIELDS), self.written)
+        header = header.ljust(self.HEADER_SIZE - 11) + "\n"
+        return np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+    def add(self, frame, time, point=None, area=0., detected=True):
+        """add frame position. point is None if mouse was not found
+        detected False - point is interpolated, row keeps position with detected 0"""
+        row = self.rows[self.count]
+        row["frame"] = frame
+        row["time"] = time
+        if point is None:
+            row["x"] = row["y"] = np.nan
+            row["area"] = 0
+            row["detected"] = False
+        else:
+            row["x"], row["y"] = point
+            row["area"] = area
+            row["detected"] = detected
+        self.count += 1
+        if self.count == self.rows.size:
+            self.flush()
+
+    def flush(self):
+        """write batch into file"""
+        rows = self.rows[:self.count]
+        self.count = 0
+        self.writeRows(rows)
+
+    def writeRows(self, rows):
+        """write structured rows after rows added before"""
+        if self.count:
+            self.flush()
+        if self.format == ".npy":
+            self.file.write(rows.astype(FIELDS, copy=False).tobytes())
+        else:
+            self.file.write("".join("%i,%.4f,%.2f,%.2f,%.1f,%i\n" % tuple(row) for row in rows.tolist())
+                            .replace("nan", "").encode())
+        self.written += rows.size
+
+    def close(self):
+        """write rest of rows and final header"""
+        if self.file.closed:
+            return
+        self.flush()
+        if self.format == ".npy":
+            self.file.seek(0)
+            self.file.write(self.header())
+        self.file.close()
+
+
+def readTrajectory(file_name):
+    """load trajectory file as structured array"""
+    if os.path.splitext(file_name)[1].lower() == ".npy":
+        return np.load(file_name, mmap_mode="r")
+    columns = np.genfromtxt(file_name, delimiter=",", names=True, dtype=np.float64, missing_values="",
+                            filling_values=np.nan)   # guessed type of empty column is bool
+    rows = np.zeros(columns.size, dtype=FIELDS)
+    for name in FIELDS.names:
+        rows[name] = columns[name]
+    return rows
+
+
+def joinTrajectories(file_names, output_name):
+    """concatenate trajectory files in given order"""
+    writer = TrajectoryWriter(output_name)
+    for file_name in file_names:
+        writer.writeRows(readTrajectory(file_name))
+    writer.close()
+
+
+def animalName(file_name, arena=None, animal=None):
+    """trajectory file of animal in arena, e.g. name.arena1.animal0.csv. parts which are None are left out"""
+    base, extension = os.path.splitext(file_name)
+    if arena is not None:
+        base += ".arena%i" % arena
+    if animal is not None:
+        base += ".animal%i" % animal
+    return base + extension
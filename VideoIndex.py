@@ -0,0 +1,103 @@
+import os
+import cv2
+import numpy as np
+import Cache
+
+
+KEY_FRAME = ord("I")    # picture type of key frame reported by ffmpeg backend
+FRAME_TYPE = getattr(cv2, "CAP_PROP_FRAME_TYPE", None)  # opencv 4.8+
+
+
+class VideoIndex(object):
+    """frame count, exact fps, timestamps and key frames of video.
+    seeks go to key frame before target and decode forward the minimum number of frames"""
+
+    def __init__(self, timestamps, key_frames=None):
+        """timestamps - milliseconds of every frame, key_frames - sorted frame numbers or None if unknown"""
+        self.timestamps = timestamps
+        self.key_frames = key_frames
+        self.frame_count = timestamps.size
+        if self.frame_count > 1 and timestamps[-1] > timestamps[0]:
+            self.fps = (self.frame_count - 1) * 1e3 / (timestamps[-1] - timestamps[0])
+        else:
+            self.fps = 0.
+
+    def frameAt(self, second):
+        """number of frame shown at given second"""
+        number = np.searchsorted(self.timestamps, second * 1e3 + 1e-3, side="right") - 1
+        return int(min(max(number, 0), max(self.frame_count - 1, 0)))
+
+    def keyFrameBefore(self, number):
+        """nearest key frame at or before frame number"""
+        return int(self.key_frames[max(np.searchsorted(self.key_frames, number, side="right") - 1, 0)])
+
+    def seek(self, capture, number):
+        """make next read of capture return frame number"""
+        if self.key_frames is None or not self.key_frames.size:   # no key frames known, let backend seek
+            capture.set(cv2.CAP_PROP_POS_FRAMES, number)
+            return
+        position = int(capture.get(cv2.CAP_PROP_POS_FRAMES))   # frame next read returns
+        key_frame = self.keyFrameBefore(number)
+        if not key_frame <= position <= number:     # forward within same group of pictures needs no seek
+            capture.set(cv2.CAP_PROP_POS_FRAMES, key_frame)
+            position = key_frame
+        for i in range(number - position):
+            capture.grab()
+
+    def readFrame(self, capture, number):
+        """seek and read frame. return frame or None"""
+        self.seek(capture, number)
+        is_frame, frame = capture.read()
+        return frame if is_frame else None
+
+
+def buildIndex(video_name, visit=None):
+    """read whole video once. frames are grabbed only, not converted into images
+    visit - called as visit(capture, number, milliseconds) after every grab, may retrieve grabbed frame"""
+    capture = cv2.VideoCapture(video_name)
+    if not capture.isOpened():
+        raise IOError("can't open video %s" % video_name)
+    timestamps = []
+    key_frames = []
+    known_types = FRAME_TYPE is not None
+    while capture.grab():
+        if known_types:
+            frame_type = int(capture.get(FRAME_TYPE))
+            if frame_type <= 0:     # backend doesn't report picture types
+                known_types = False
+            elif frame_type == KEY_FRAME:
+                key_frames.append(len(timestamps))
+        timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+        if visit is not None:
+            visit(capture, len(timestamps) - 1, timestamps[-1])
+    capture.release()
+    return VideoIndex(np.array(timestamps, dtype=np.float64),
+                      np.array(key_frames, dtype=np.int64) if known_types else None)
+
+
+def cachedIndex(video_name):
+    """index from sidecar cache file or None"""
+    cache_name = Cache.cacheName(video_name, "index.npz")
+    if not os.path.isfile(cache_name):
+        return None
+    with np.load(cache_name) as data:
+        return VideoIndex(data["timestamps"], data["key_frames"] if data["key_frames_known"] else None)
+
+
+def loadIndex(video_name, cache=True, visit=None):
+    """index from sidecar cache file or build and save it. visit is passed to buildIndex, it's not called for
+    cached index"""
+    if not cache:
+        return buildIndex(video_name, visit)
+    index = cachedIndex(video_name)
+    if index is not None:
+        return index
+    cache_name = Cache.cacheName(video_name, "index.npz")
+    index = buildIndex(video_name, visit)
+    temporary_name = Cache.temporaryName(cache_name)
+    with open(temporary_name, "wb") as cache_file:
+        np.savez(cache_file, timestamps=index.timestamps,
+                 key_frames=index.key_frames if index.key_frames is not None else np.zeros(0, dtype=np.int64),
+                 key_frames_known=index.key_frames is not None)
+    os.replace(temporary_name, cache_name)
+    return index
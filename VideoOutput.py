@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import cv2
+import Profiler
+import BufferPool
+
+
+CODECS = {"pim1": ("PIM1", ".avi"),     # mpeg-1, small files, slow
+          "mjpg": ("MJPG", ".avi"),     # fast, large files
+          "xvid": ("XVID", ".avi"),     # fast and small
+          "ffv1": ("FFV1", ".mkv"),     # lossless
+          "jpg": (None, ""),    # image sequence in directory named after output
+          "png": (None, "")}    # lossless image sequence
+IMAGE_NAME = "%06d"     # frame number in image sequence
+
+
+def outputName(file_name, codec):
+    """file name with extension codec is written into, directory for image sequences"""
+    extension = CODECS[codec][1]
+    base, old_extension = os.path.splitext(file_name)
+    if not extension:
+        return base
+    return file_name if old_extension.lower() == extension else base + extension
+
+
+def openCapture(file_name, codec):
+    """capture reading output written with codec"""
+    if CODECS[codec][0] is None:
+        return cv2.VideoCapture(os.path.join(file_name, IMAGE_NAME + "." + codec), cv2.CAP_IMAGES)
+    return cv2.VideoCapture(file_name)
+
+
+class VideoOutput(object):
+    """encoder thread fed by bounded queue, so encoding never runs under tracking locks.
+    frames are resized to output size in encoder thread, overlay is drawn on tracking size frame before
+    file_name - video file or directory of image sequence
+    size - output resolution, frames of other size are resized
+    pool - BufferPool.FramePool frames are given back to once they are encoded"""
+
+    def __init__(self, file_name, fps, size, codec="pim1", queue_size=8, profiler=None, pool=None):
+        self.file_name = file_name
+        self.size = tuple(size)
+        self.codec = codec
+        self.fourcc = CODECS[codec][0]
+        self.profiler = profiler or Profiler.DISABLED
+        self.pool = pool
+        self.buffers = pool.buffers() if pool else BufferPool.Buffers()    # output size frame
+        self.written = 0
+        self.error = None   # first encoding error, later frames are dropped. raised by release
+        self.video_writer = None
+        if self.fourcc is None:
+            os.makedirs(file_name, exist_ok=True)
+            self.opened = True
+        else:
+            self.video_writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*self.fourcc), fps, self.size)
+            self.opened = self.video_writer.isOpened()
+            if not self.opened:     # encoder would drop every frame silently
+                raise IOError("can't open output %s" % file_name)
+        self.frames = queue.Queue(queue_size)
+        self.encoder = threading.Thread(target=self.encode, name="encoder")
+        self.encoder.start()
+
+    def isOpened(self):
+        return self.opened
+
+    def write(self, frame):
+        """give frame to encoder. blocks only while queue is full. frame must not be changed afterwards,
+        it goes back to pool after encoding"""
+        self.frames.put(frame)
+
+    def encode(self):
+        """encoder thread. after error queue is still drained, so writer never blocks on it"""
+        profiler = self.profiler
+        while True:
+            start = profiler.clock()
+            frame = self.frames.get()
+            if frame is None:
+                break
+            start = profiler.add("encoder_wait", start)
+            if self.error is None:
+                try:
+                    output = frame
+                    if (frame.shape[1], frame.shape[0]) != self.size:
+                        output = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA,
+                                            dst=self.buffers.get("resized", (self.size[1], self.size[0], 3)))
+                        start = profiler.add("output_resize", start)
+                    if self.video_writer is not None:
+                        self.video_writer.write(output)
+                    else:
+                        image_name = os.path.join(self.file_name, IMAGE_NAME % self.written + "." + self.codec)
+                        if not cv2.imwrite(image_name, output,
+                                           [cv2.IMWRITE_PNG_COMPRESSION, 1] if self.codec == "png" else []):
+                            raise IOError("can't write %s" % image_name)
+                    self.written += 1
+                    profiler.add("encode", start)
+                except Exception as error:
+                    self.error = error
+            if self.pool is not None:
+                self.pool.put(frame)
+
+    def release(self):
+        """encode queued frames and close file. raise encoding error"""
+        if self.encoder.is_alive():
+            self.frames.put(None)
+            self.encoder.join()
+        if self.video_writer is not None:
+            self.video_writer.release()
+        self.opened = False
+        if self.error is not None:
+            raise self.error
@@ -7,6 +7,7 @@ import numpy as np
 
 
 __location__ = os.path.dirname(__file__)
+BGR_FORMAT = getattr(QImage, "Format_BGR888", None)     # qt 5.14+
 
 
 class Picker(QLabel):
@@ -55,18 +56,21 @@ class Picker(QLabel):
 
 
 class ProceedImage(QThread):
-    """get images from rendering threads via queue and updates viewport"""
+    """get latest images from rendering threads via preview channel and updates viewport"""
     update_viewport = pyqtSignal(np.ndarray)
     update_slider = pyqtSignal(int)
 
-    def __init__(self, image_queue):
+    def __init__(self, preview):
         QThread.__init__(self)
-        self.queue = image_queue
+        self.preview = preview
 
     def run(self):
         """get images and emit qsignal"""
         while True:
-            time_seconds, frame_array = self.queue.get()
+            item = self.preview.get()
+            if item is None:
+                continue
+            time_seconds, frame_array = item
             self.update_slider.emit(int(time_seconds))
             self.update_viewport.emit(frame_array)
 
@@ -78,6 +82,7 @@ class VideoWidget(QStackedWidget):
 
     def __init__(self):
         QWidget.__init__(self)
+        self.image_buffers = {}     # destination arrays for resize and color swap
         self.image_player = QLabel()
         self.image_player.setAlignment(Qt.AlignCenter)
         self.video_player = QVideoWidget()
@@ -96,13 +101,28 @@ class VideoWidget(QStackedWidget):
         self.setFixedSize(640 * resolution, 360 * resolution)
 
     def setMatrixImage(self, array):
-        """set background image from numpy array"""
-        array = cv2.resize(array, (self.width(), self.height()))
-        array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)      # reverse BGR to RGB
-        image = QImage(array.data, array.shape[1], array.shape[0], QImage.Format_RGB888)
-        self.image_player.setPixmap(QPixmap(image))
+        """set background image from numpy array. resize and color swap go into reused buffers,
+        the only copy is into pixmap. frames of viewport size from preview channel are not resized"""
+        size = self.width(), self.height()
+        if array.shape[:2] != (size[1], size[0]):
+            array = cv2.resize(array, size, dst=self.imageBuffer("resized", size))
+        if BGR_FORMAT is None:  # qt older than 5.14 has no bgr images
+            array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=self.imageBuffer("rgb", size))
+            image_format = QImage.Format_RGB888
+        else:
+            array = np.ascontiguousarray(array)
+            image_format = BGR_FORMAT
+        image = QImage(array.data, array.shape[1], array.shape[0], array.strides[0], image_format)
+        self.image_player.setPixmap(QPixmap.fromImage(image))
         self.setCurrentWidget(self.image_player)
 
+    def imageBuffer(self, name, size):
+        """reusable 3 channel buffer of given size"""
+        buffer = self.image_buffers.get(name)
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = self.image_buffers[name] = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        return buffer
+
     def setDefaultImage(self):
         """set default background image"""
         self.setCurrentWidget(self.image_player)